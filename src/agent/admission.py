@@ -0,0 +1,123 @@
+"""
+Admission control for LLM completions.
+
+At most `LLM_MAX_CONCURRENCY` completions run at once in this process, which
+should match the parallel slots of the model server (`OLLAMA_NUM_PARALLEL`)
+divided by the number of worker processes. Further calls wait in a queue of at
+most `LLM_MAX_QUEUE`. When the queue is full, calls are rejected at once (429).
+Calls that wait longer than `LLM_QUEUE_TIMEOUT` seconds are rejected too (503).
+"""
+
+import contextlib
+import functools
+import os
+import threading
+import time
+from typing import Dict
+
+from agent.deadline import check, clip_timeout
+from agent.metrics import registry
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when an LLM call is not admitted.
+
+    Args:
+        message (str): Why the call was rejected.
+        status (int): HTTP status to answer with, 429 (queue full) or 503 (wait timed out).
+    """
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class LLMAdmission:
+    """
+    Bounded concurrency with a bounded wait queue.
+
+    Args:
+        max_concurrency (int): Completions allowed to run at once; 0 disables the limit.
+        max_queue (int): Calls allowed to wait for a slot.
+        timeout (float): Seconds a call may wait before it is rejected.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMAdmission":
+        return cls(
+            int(os.getenv("LLM_MAX_CONCURRENCY", 4)),
+            int(os.getenv("LLM_MAX_QUEUE", 32)),
+            float(os.getenv("LLM_QUEUE_TIMEOUT", 60)),
+        )
+
+    def saturated(self) -> bool:
+        """Whether a new call would be rejected right now because the queue is full."""
+        with self._condition:
+            return (
+                self.max_concurrency > 0 and self._running >= self.max_concurrency and self._waiting >= self.max_queue
+            )
+
+    @contextlib.contextmanager
+    def slot(self, stage: str):
+        """
+        Hold one of the completion slots for the duration of the block.
+
+        Raises:
+            AdmissionRejected: If the queue is full or no slot freed up in time.
+            DeadlineExceeded: If the request deadline passed while waiting.
+        """
+        if self.max_concurrency <= 0:
+            yield
+            return
+
+        start = time.perf_counter()
+        with self._condition:
+            if self._running >= self.max_concurrency:
+                if self._waiting >= self.max_queue:
+                    registry.increment("goat_nlp_llm_rejected_total", "Rejected LLM calls.", reason="queue_full")
+                    raise AdmissionRejected("LLM queue is full", 429)
+                self._waiting += 1
+                try:
+                    admitted = self._condition.wait_for(
+                        lambda: self._running < self.max_concurrency,
+                        timeout=clip_timeout(self.timeout, f"{stage} LLM slot"),
+                    )
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    check(f"{stage} LLM slot")
+                    registry.increment("goat_nlp_llm_rejected_total", "Rejected LLM calls.", reason="timeout")
+                    raise AdmissionRejected(f"No LLM slot within {self.timeout:g}s", 503)
+            self._running += 1
+        registry.observe(
+            "goat_nlp_llm_queue_wait_seconds",
+            "Time an LLM call waited for a slot.",
+            time.perf_counter() - start,
+            stage=stage,
+        )
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify()
+
+    def stats(self) -> Dict[str, int]:
+        """Completions running and waiting right now."""
+        with self._condition:
+            return {"running": self._running, "waiting": self._waiting}
+
+
+@functools.lru_cache(maxsize=None)
+def get_llm_admission() -> LLMAdmission:
+    return LLMAdmission.from_env()
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from agent.embeddings import embed_query, embed_texts
+
+logger = logging.getLogger("goat_nlp.attribute_retriever")
+
+ATTRIBUTE_TOP_K = int(os.getenv("ATTRIBUTE_TOP_K", 0))
+ATTRIBUTE_MIN_SIMILARITY = float(os.getenv("ATTRIBUTE_MIN_SIMILARITY", 0.0))
+ATTRIBUTE_EMBEDDING_TTL = int(os.getenv("ATTRIBUTE_API_TTL", 2 * 24 * 60 * 60))
+
+# index -> (metadata hash, created at, embeddings)
+_embedding_cache: Dict[str, Tuple[str, float, np.ndarray]] = {}
+_embedding_lock = threading.Lock()
+
+
+def _attribute_text(attribute: Dict[str, Any]) -> str:
+    parts = [attribute["name"].replace("_", " ")]
+    for key in ("description", "constraint", "value_metadata"):
+        if attribute.get(key):
+            parts.append(attribute[key] if isinstance(attribute[key], str) else json.dumps(attribute[key]))
+    return ". ".join(parts)
+
+
+def attribute_embeddings(index: str, attributes: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Embeddings of each attribute's name, description and constraints, one row per attribute.
+
+    Computed once per index and reused until the attribute metadata changes or
+    `ATTRIBUTE_API_TTL` expires, matching the lifetime of `attribute_api_call`.
+    """
+    metadata_hash = hashlib.sha256(json.dumps(attributes, sort_keys=True).encode()).hexdigest()
+    with _embedding_lock:
+        cached = _embedding_cache.get(index)
+        if cached is not None and cached[0] == metadata_hash and time.time() - cached[1] < ATTRIBUTE_EMBEDDING_TTL:
+            return cached[2]
+        embeddings = embed_texts([_attribute_text(attribute) for attribute in attributes])
+        _embedding_cache[index] = (metadata_hash, time.time(), embeddings)
+        logger.info(f"Embedded {len(attributes)} attributes for {index} index")
+        return embeddings
+
+
+def shortlist_attributes(query: str, index: str, attributes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The `ATTRIBUTE_TOP_K` attributes most similar to the query.
+
+    The full list is returned when shortlisting is disabled (`ATTRIBUTE_TOP_K=0`),
+    when no attribute reaches `ATTRIBUTE_MIN_SIMILARITY`, or when the embedding
+    model is unavailable.
+    """
+    if ATTRIBUTE_TOP_K <= 0 or len(attributes) <= ATTRIBUTE_TOP_K:
+        return attributes
+    try:
+        similarities = attribute_embeddings(index, attributes) @ embed_query(query)
+    except Exception:
+        logger.exception("Attribute shortlisting failed, using the full attribute list")
+        return attributes
+
+    top = np.argsort(-similarities)[:ATTRIBUTE_TOP_K]
+    if similarities[top[0]] < ATTRIBUTE_MIN_SIMILARITY:
+        return attributes
+    return [attributes[i] for i in sorted(top)]
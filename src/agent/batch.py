@@ -0,0 +1,68 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from agent.component_helpers import INDICES, attribute_api_call
+from agent.deadline import REQUEST_DEADLINE, Deadline, use_deadline
+from agent.translator import translate
+
+logger = logging.getLogger("goat_nlp.batch")
+
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", 4))
+
+
+def _translate_one(query: str) -> Dict[str, Any]:
+    try:
+        with use_deadline(Deadline(REQUEST_DEADLINE)):
+            state = translate(query)
+        return {"url": state["final_url"], "error": None, "degraded": state.get("degraded", [])}
+    except Exception as e:
+        logger.warning(f"Batch item failed: {query!r}")
+        return {"url": "", "error": str(e.__cause__ or e), "degraded": []}
+
+
+def translate_batch(queries: Iterable[str], max_workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Translate many queries, yielding one result per input as soon as it is ready.
+
+    Queries that differ only in case and whitespace are translated once and the result is
+    fanned back out to every position they occurred at. Attribute metadata is
+    fetched once per index up front and GoaT taxon searches are cached, so the
+    items in a batch share those sub-results instead of repeating them.
+
+    Args:
+        queries (Iterable[str]): The natural language queries.
+        max_workers (int, optional): Number of queries translated concurrently,
+            between 1 and `BATCH_MAX_WORKERS`.
+
+    Yields:
+        dict: `{"index", "query", "url", "error", "degraded"}` in completion order.
+    """
+    queries = list(queries)
+    positions: Dict[str, List[int]] = {}
+    for position, query in enumerate(queries):
+        # Only case and whitespace are folded: operators, numbers and punctuation can change the translation.
+        positions.setdefault(" ".join(query.casefold().split()), []).append(position)
+
+    logger.info(f"Translating batch of {len(queries)} queries ({len(positions)} distinct)")
+
+    for index in INDICES:
+        try:
+            attribute_api_call(index)
+        except Exception:
+            logger.exception(f"Could not preload attribute metadata for {index}")
+
+    max_workers = max(1, min(max_workers or BATCH_MAX_WORKERS, BATCH_MAX_WORKERS))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="goat_batch")
+    try:
+        futures = {
+            executor.submit(_translate_one, queries[duplicates[0]]): duplicates for duplicates in positions.values()
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            for position in futures[future]:
+                yield {"index": position, "query": queries[position], **result}
+    finally:
+        # Stop queued work if the consumer goes away (e.g. the HTTP client disconnects).
+        executor.shutdown(wait=False, cancel_futures=True)
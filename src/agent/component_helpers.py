@@ -1,17 +1,30 @@
+import functools
 import json
 import logging
 import os
+import re
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Tuple
 
 import cachetools.func
-import requests
-from llama_index.core import Settings
 from llama_index.core.output_parsers.utils import extract_json_str
 
+from agent.attribute_retriever import ATTRIBUTE_TOP_K, shortlist_attributes
+from agent.deadline import degrade
+from agent.entity_detector import detect_entities
+from agent.fast_classifier import fast_classify
+from agent.goat_client import get_goat_client
+from agent.llm import complete
+from agent.metrics import registry
+from agent.prompt_budget import to_prompt_json
+from agent.response_cache import normalize_query
+from agent.schemas import INDICES, INTENTS, parse_response
+from agent.taxonomy import get_taxonomy_store
 from prompt import (
     ATTRIBUTE_PROMPT,
+    CLASSIFICATION_PROMPT,
     ENTITY_PROMPT,
     INDEX_PROMPT,
     INTENT_PROMPT,
@@ -23,67 +36,180 @@ from prompt import (
 
 logger = logging.getLogger("goat_nlp.component_helpers")
 
+DATE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})?$")
 
-def identify_index(input: str, state: Dict[str, Any]):
-    index_response = Settings.llm.complete(INDEX_PROMPT.format(query=input)).text
-    state["index"] = json.loads(extract_json_str(index_response))
+# Entity searches: results per lookup and the attribute fields returned with them ("none" for just the taxa).
+ENTITY_SEARCH_SIZE = int(os.getenv("ENTITY_SEARCH_SIZE", 10))
+ENTITY_SEARCH_FIELDS = os.getenv("ENTITY_SEARCH_FIELDS", "none")
+
+# Speculative GoaT lookups started as soon as the entities and the index are known.
+PREFETCH = os.getenv("PREFETCH", "true").lower() == "true"
+PREFETCH_LINEAGE_TOP = int(os.getenv("PREFETCH_LINEAGE_TOP", 1))
+_prefetch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PREFETCH_MAX_WORKERS", 4)),
+    thread_name_prefix="goat_prefetch",
+)
 
-    if "classification" not in state["index"] or "explanation" not in state["index"]:
-        raise ValueError("Invalid response from model at index identification stage.")
+# State keys each stage writes, keyed by stage name.
+STAGE_OUTPUTS = {
+    "intent": ("intent",),
+    "index": ("index",),
+    "time": ("timeframe",),
+    "classification": ("intent", "index", "timeframe"),
+    "entity": ("entity",),
+    "rank": ("rank",),
+    "attribute": ("attributes",),
+    "query": ("query", "lineage", "lineage_of", "index"),
+    "url": ("final_url",),
+    "record": ("record", "final_url"),
+}
 
 
-def identify_entity(input: str, state: Dict[str, Any]):
-    entity_response = Settings.llm.complete(ENTITY_PROMPT.format(query=input)).text
-    state["entity"] = json.loads(extract_json_str(entity_response))
+def identify_index(input: str, state: Dict[str, Any]):
+    if (prediction := fast_classify("index", input)) is not None:
+        state["index"] = {
+            "classification": prediction[0],
+            "explanation": f"Fast-path classifier (p={prediction[1]:.3f})",
+        }
+    else:
+        index_response = complete("index", INDEX_PROMPT.format(query=input), state)
+        state["index"] = parse_response("index", index_response)
+    prefetch_entity_lookups(state)
+
 
-    if "entities" not in state["entity"] or "explanation" not in state["entity"]:
-        raise ValueError("Invalid response from model at entity identification stage.")
+def identify_entity(input: str, state: Dict[str, Any]):
+    if (entities := detect_entities(input)) is not None:
+        state["entity"] = {"entities": entities, "explanation": "Entity lexicon match"}
+    else:
+        entity_response = complete("entity", ENTITY_PROMPT.format(query=input), state)
+        state["entity"] = parse_response("entity", entity_response)
+    prefetch_entity_lookups(state)
 
 
 def identify_rank(input: str, state: Dict[str, Any]):
     cleaned_taxons = query_entity(state, query_operator="tax_tree", include_sub_species=False)
-    rank_response = Settings.llm.complete(
-        RANK_PROMPT.format(query=input, results=json.dumps(cleaned_taxons, indent=4))
-    ).text
-    state["rank"] = json.loads(extract_json_str(rank_response))
-
-    if "rank" not in state["rank"] or "explanation" not in state["rank"]:
-        raise ValueError("Invalid response from model at rank identification stage.")
+    rank_response = complete(
+        "rank", RANK_PROMPT.format(query=input, results=to_prompt_json(cleaned_taxons, "rank")), state
+    )
+    state["rank"] = parse_response("rank", rank_response)
 
 
 def identify_time_frame(input: str, state: Dict[str, Any]):
-    time_response = Settings.llm.complete(
-        TIME_PROMPT.format(query=input, time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-    ).text
-    state["timeframe"] = json.loads(extract_json_str(time_response))
-
-    if (
-        "from_date" not in state["timeframe"]
-        or "to_date" not in state["timeframe"]
-        or "explanation" not in state["timeframe"]
-    ):
-        raise ValueError("Invalid response from model at timeframe identification stage.")
+    time_response = complete(
+        "time", TIME_PROMPT.format(query=input, time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")), state
+    )
+    state["timeframe"] = parse_response("time", time_response)
 
 
 def identify_intent(input: str, state: Dict[str, Any]):
-    intent_response = Settings.llm.complete(INTENT_PROMPT.format(query=input)).text
-    state["intent"] = json.loads(extract_json_str(intent_response))
-
-    if "intent" not in state["intent"] or "explanation" not in state["intent"]:
-        raise ValueError("Invalid response from model at intent identification stage.")
+    if (prediction := fast_classify("intent", input)) is not None:
+        state["intent"] = {"intent": prediction[0], "explanation": f"Fast-path classifier (p={prediction[1]:.3f})"}
+        return
+
+    intent_response = complete("intent", INTENT_PROMPT.format(query=input), state)
+    state["intent"] = parse_response("intent", intent_response)
+
+
+def identify_classification(input: str, state: Dict[str, Any]):
+    """
+    Fill `state["intent"]`, `state["index"]` and `state["timeframe"]` from a single completion.
+
+    Each field that is missing or invalid in the fused response falls back to
+    its own stage (`identify_intent`, `identify_index`, `identify_time_frame`).
+    Intent and index labels from a confident fast-path classifier take precedence,
+    and when it is confident about both only the time frame is asked for.
+    """
+    intent, index = fast_classify("intent", input), fast_classify("index", input)
+    if intent is not None:
+        state["intent"] = {"intent": intent[0], "explanation": f"Fast-path classifier (p={intent[1]:.3f})"}
+    if index is not None:
+        state["index"] = {"classification": index[0], "explanation": f"Fast-path classifier (p={index[1]:.3f})"}
+    if intent is not None and index is not None:
+        identify_time_frame(input, state)
+        prefetch_entity_lookups(state)
+        return
+
+    classification_response = complete(
+        "classification",
+        CLASSIFICATION_PROMPT.format(query=input, time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        state,
+    )
+    try:
+        classification = json.loads(extract_json_str(classification_response))
+        if not isinstance(classification, dict):
+            raise ValueError(f"Expected a JSON object, got {type(classification).__name__}")
+    except ValueError:
+        logger.warning("Invalid response from model at fused classification stage, falling back.")
+        classification = {}
+    explanation = classification.get("explanation", "")
+
+    if intent is not None:
+        pass
+    elif classification.get("intent") in INTENTS:
+        state["intent"] = {"intent": classification["intent"], "explanation": explanation}
+    else:
+        identify_intent(input, state)
+
+    if index is not None:
+        pass
+    elif classification.get("classification") in INDICES:
+        state["index"] = {"classification": classification["classification"], "explanation": explanation}
+    else:
+        identify_index(input, state)
+
+    from_date = classification.get("from_date")
+    to_date = classification.get("to_date")
+    if (
+        isinstance(from_date, str)
+        and isinstance(to_date, str)
+        and DATE_PATTERN.match(from_date)
+        and DATE_PATTERN.match(to_date)
+    ):
+        state["timeframe"] = {"from_date": from_date, "to_date": to_date, "explanation": explanation}
+    else:
+        identify_time_frame(input, state)
+    prefetch_entity_lookups(state)
 
 
 @cachetools.func.ttl_cache(ttl=int(os.getenv("ATTRIBUTE_API_TTL", 2 * 24 * 60 * 60)))
 def attribute_api_call(index: str):
-    response = requests.get(f'{os.getenv("GOAT_BASE_URL")}/resultFields?result={index}&taxonomy=ncbi')
+    response_parsed = get_goat_client().get_json("resultFields", {"result": index, "taxonomy": "ncbi"})
 
     logger.info(f"Made API call for {index} endpoint")
 
-    response_parsed = response.json()
     return response_parsed if response_parsed["status"]["success"] else None
 
 
+def _search(query: str, index: str, size: int) -> dict:
+    response_parsed = get_goat_client().get_json(
+        "search",
+        {
+            "query": query,
+            "result": index,
+            "taxonomy": "ncbi",
+            "size": size,
+            "fields": ENTITY_SEARCH_FIELDS,
+            "includeEstimates": "false",
+        },
+    )
+
+    logger.info(f"Made API call for search endpoint: {query}")
+
+    if not response_parsed["status"]["success"]:
+        # Raising keeps unsuccessful responses out of the cache.
+        raise ValueError(f"Error querying search API: {query}")
+    return response_parsed
+
+
+@cachetools.func.ttl_cache(maxsize=1024, ttl=int(os.getenv("SEARCH_API_TTL", 24 * 60 * 60)))
+def search_api_call(query: str, index: str, size: int = ENTITY_SEARCH_SIZE) -> dict:
+    return _search(query, index, size)
+
+
 def identify_attributes(input: str, state: Dict[str, Any]):
+    if degrade("attribute", state):
+        state["attributes"] = {"attributes": [], "explanation": "Skipped: not enough time left"}
+        return
 
     attributes = attribute_api_call(state["index"]["classification"])
     cleaned_attributes = [
@@ -96,41 +222,45 @@ def identify_attributes(input: str, state: Dict[str, Any]):
         for name, attribute in attributes["fields"].items()
     ]
 
-    attribute_response = Settings.llm.complete(
+    shortlisted = ATTRIBUTE_TOP_K > 0
+    if shortlisted:
+        cleaned_attributes = shortlist_attributes(input, state["index"]["classification"], cleaned_attributes)
+
+    attribute_response = complete(
+        "attribute",
         ATTRIBUTE_PROMPT.format(
-            attribute_metadata=json.dumps(cleaned_attributes, indent=4),
+            # A shortlist is always sent compact; otherwise COMPACT_PROMPTS decides.
+            attribute_metadata=to_prompt_json(cleaned_attributes, "attribute", compact=True if shortlisted else None),
             query=input,
-        )
-    ).text
-    state["attributes"] = json.loads(extract_json_str(attribute_response))
-
-    if "attributes" not in state["attributes"] or "explanation" not in state["attributes"]:
-        raise ValueError("Invalid response from model at attribute identification stage.")
+        ),
+        state,
+    )
+    state["attributes"] = parse_response("attribute", attribute_response)
 
 
 def construct_query(input: str, state: Dict[str, Any]):
     query = ""
 
     if state["rank"]["rank"] != "":
-        if "taxon_id" in state["rank"] and state["rank"]["taxon_id"]:
-            taxon_id_filter = f"tax_name({str(state['rank']['taxon_id'])})"
-            query_url = f"{os.getenv('GOAT_BASE_URL')}/search?query={urllib.parse.quote(taxon_id_filter)}"
-            query_url += f"&result={state['index']['classification']}"
-
-            response = requests.get(query_url)
-            response_parsed = response.json()
-
-            if not response_parsed["status"]["success"]:
-                raise ValueError("Error querying API to fetch taxon lineage details.")
-
-            parent_taxon_id_response = Settings.llm.complete(
-                LINEAGE_PROMPT.format(
-                    query=input, lineage=json.dumps(response_parsed["results"][0]["result"]["lineage"], indent=4)
-                )
-            ).text
+        if (
+            "taxon_id" in state["rank"]
+            and state["rank"]["taxon_id"]
+            and state.get("lineage_of") == state["rank"]["taxon_id"]
+        ):
+            # A follow-up query that kept the taxon reuses the parent taxon picked last time.
+            query += f"tax_tree({parse_response('lineage', state['lineage'])['taxon_id']}) AND "
+        elif "taxon_id" in state["rank"] and state["rank"]["taxon_id"] and degrade("lineage", state):
+            # Without the lineage refinement the query is anchored at the taxon the rank stage picked.
+            query += f"tax_tree({state['rank']['taxon_id']}) AND "
+        elif "taxon_id" in state["rank"] and state["rank"]["taxon_id"]:
+            lineage = fetch_lineage(state["rank"]["taxon_id"], state["index"]["classification"])
+            parent_taxon_id_response = complete(
+                "lineage", LINEAGE_PROMPT.format(query=input, lineage=to_prompt_json(lineage, "lineage")), state
+            )
             try:
-                parent_taxon_id = json.loads(extract_json_str(parent_taxon_id_response))["taxon_id"]
+                parent_taxon_id = parse_response("lineage", parent_taxon_id_response)["taxon_id"]
                 state["lineage"] = parent_taxon_id_response
+                state["lineage_of"] = state["rank"]["taxon_id"]
             except Exception as e:
                 raise ValueError("Error fetching parent taxon id from lineage details from model.") from e
             query += f"tax_tree({parent_taxon_id}) AND "
@@ -169,18 +299,12 @@ def construct_url(input: str, state: Dict[str, Any]):
 
 
 def identify_record(input: str, state: Dict[str, Any]):
-    cleaned_taxons = query_entity(state)
-
-    for taxon in cleaned_taxons:
-        taxon.pop("lineage", None)
-
-    taxon_response = Settings.llm.complete(
-        RECORD_PROMPT.format(query=input, results=json.dumps(cleaned_taxons, indent=4))
-    ).text
-    state["record"] = json.loads(extract_json_str(taxon_response))
+    cleaned_taxons = query_entity(state, include_lineage=False)
 
-    if "taxon_id" not in state["record"] or "explanation" not in state["record"]:
-        raise ValueError("Invalid response from model at record identification stage.")
+    taxon_response = complete(
+        "record", RECORD_PROMPT.format(query=input, results=to_prompt_json(cleaned_taxons, "record")), state
+    )
+    state["record"] = parse_response("record", taxon_response)
 
     state["final_url"] = (
         "https://goat.genomehubs.org/record?recordId="
@@ -189,32 +313,224 @@ def identify_record(input: str, state: Dict[str, Any]):
     )
 
 
-def query_entity(state: Dict[str, Any], query_operator="tax_name", include_sub_species=True) -> list:
-    if "entities" not in state["entity"] or state["entity"]["entities"] == []:
-        return []
-    entities = ""
-    for entity in state["entity"]["entities"]:
-        entities += f"{entity['singular_form']},"
-        entities += f"{entity['plural_form']},"
-        entities += f"{entity['scientific_name']},"
-        if include_sub_species:
-            entities += f"* {entity['singular_form']},"
-            entities += f"* {entity['plural_form']},"
-
-    query_url = f'{os.getenv("GOAT_BASE_URL")}/search?query={urllib.parse.quote(f"{query_operator}({entities})")}'
-    query_url += f"&result={state['index']['classification']}"
-
-    response = requests.get(query_url)
-    response_parsed = response.json()
-    return [
-        {
-            "taxon_id": res["result"]["taxon_id"],
-            "taxon_rank": res["result"]["taxon_rank"],
-            "scientific_name": res["result"]["scientific_name"],
-            "taxon_names": (
-                [x["name"] for x in res["result"]["taxon_names"]] if "taxon_names" in res["result"] else None
-            ),
-            "lineage": res["result"]["lineage"],
+def fetch_lineage(taxon_id, index: str) -> list:
+    store = get_taxonomy_store()
+    if store is not None and str(taxon_id).isdigit() and int(taxon_id) in store:
+        return store.lineage(int(taxon_id))
+
+    try:
+        response_parsed = search_api_call(f"tax_name({str(taxon_id)})", index, size=1)
+    except ValueError as e:
+        raise ValueError("Error querying API to fetch taxon lineage details.") from e
+    return response_parsed["results"][0]["result"]["lineage"]
+
+
+Entity = Tuple[str, str, str]
+
+
+def _entity_keys(state: Dict[str, Any]) -> list:
+    """(singular, plural, scientific) names of every entity, without duplicates."""
+    return list(
+        dict.fromkeys(
+            (entity["singular_form"], entity["plural_form"], entity["scientific_name"])
+            for entity in state["entity"]["entities"]
+        )
+    )
+
+
+def entity_search_query(entity: Entity, query_operator: str, include_sub_species: bool) -> str:
+    names = list(entity)
+    if include_sub_species:
+        names += [f"* {entity[0]}", f"* {entity[1]}"]
+    return f"{query_operator}({','.join(dict.fromkeys(names))})"
+
+
+@functools.lru_cache(maxsize=int(os.getenv("ENTITY_CACHE_SIZE", 1024)))
+def local_entity_lookup(
+    entity: Entity, query_operator: str, include_sub_species: bool, include_lineage: bool
+) -> Optional[tuple]:
+    """
+    `entity_lookup` answered from the local taxonomy store, or None when the GoaT API has to answer it.
+
+    The store reproduces the search: exact names for `tax_name`, names ending in
+    " <name>" for the `* <name>` wildcards, and descendants for `tax_tree`. It
+    cannot when no store is configured or when it knows none of the names.
+    """
+    store = get_taxonomy_store()
+    if store is None:
+        return None
+    names = list(dict.fromkeys(entity))
+    taxon_ids = [taxon_id for name in names for taxon_id in store.lookup(name)]
+    if include_sub_species:
+        for name in dict.fromkeys(entity[:2]):
+            taxon_ids.extend(store.lookup_suffix(f" {name}", ENTITY_SEARCH_SIZE))
+    taxon_ids = list(dict.fromkeys(taxon_ids))
+    if not taxon_ids:
+        return None
+    if query_operator == "tax_tree":
+        taxon_ids = store.tree(taxon_ids, ENTITY_SEARCH_SIZE)
+    taxa = []
+    for taxon_id in taxon_ids[:ENTITY_SEARCH_SIZE]:
+        taxon = {
+            "taxon_id": str(taxon_id),
+            "taxon_rank": store.rank(taxon_id),
+            "scientific_name": store.scientific_name(taxon_id),
+            "taxon_names": store.names(taxon_id),
         }
-        for res in response_parsed["results"]
+        if include_lineage:
+            taxon["lineage"] = store.lineage(taxon_id)
+        taxa.append(taxon)
+    return tuple(taxa)
+
+
+@cachetools.func.ttl_cache(
+    maxsize=int(os.getenv("ENTITY_CACHE_SIZE", 1024)), ttl=int(os.getenv("ENTITY_CACHE_TTL", 24 * 60 * 60))
+)
+def entity_lookup(
+    entity: Entity, query_operator: str, include_sub_species: bool, index: str, include_lineage: bool
+) -> tuple:
+    """
+    Taxa matching one entity, projected to what the stages use, cached per entity, operator and index.
+
+    The response is decoded whole, but only each result's id, rank and names
+    (plus lineage when `include_lineage`) are kept, so the cache holds no more
+    than that. A `tax_tree` lookup always includes the taxa named like the
+    entity, which the size cap could otherwise cut from the descendants.
+    """
+    # Uncached: only the projection below is kept.
+    response_parsed = _search(
+        entity_search_query(entity, query_operator, include_sub_species), index, ENTITY_SEARCH_SIZE
+    )
+    taxa = [_project(res["result"], include_lineage) for res in response_parsed["results"]]
+    if query_operator == "tax_tree" and not _named_like(entity, taxa):
+        exact = _search(entity_search_query(entity, "tax_name", False), index, ENTITY_SEARCH_SIZE)
+        named = [_project(res["result"], include_lineage) for res in exact["results"]]
+        named_ids = {taxon["taxon_id"] for taxon in named}
+        taxa = (named + [taxon for taxon in taxa if taxon["taxon_id"] not in named_ids])[:ENTITY_SEARCH_SIZE]
+    return tuple(taxa)
+
+
+def _project(result: Dict[str, Any], include_lineage: bool) -> Dict[str, Any]:
+    taxon = {
+        "taxon_id": result["taxon_id"],
+        "taxon_rank": result["taxon_rank"],
+        "scientific_name": result["scientific_name"],
+        "taxon_names": ([x["name"] for x in result["taxon_names"]] if "taxon_names" in result else None),
+    }
+    if include_lineage:
+        taxon["lineage"] = result["lineage"]
+    return taxon
+
+
+def _named_like(entity: Entity, taxa) -> list:
+    """The taxa whose scientific name or one of whose names is one of the entity's names."""
+    names = {name.lower() for name in entity}
+    return [
+        taxon
+        for taxon in taxa
+        if taxon["scientific_name"].lower() in names
+        or any(name.lower() in names for name in taxon["taxon_names"] or [])
     ]
+
+
+def query_entity(
+    state: Dict[str, Any], query_operator="tax_name", include_sub_species=True, include_lineage=True
+) -> list:
+    if "entities" not in state["entity"] or state["entity"]["entities"] == []:
+        return []
+
+    taxons = {}
+    for entity in _entity_keys(state):
+        # Each entity the local store cannot answer for goes to the GoaT API.
+        taxa = local_entity_lookup(entity, query_operator, include_sub_species, include_lineage)
+        if taxa is None:
+            taxa = entity_lookup(
+                entity, query_operator, include_sub_species, state["index"]["classification"], include_lineage
+            )
+        for taxon in taxa:
+            # Copies, so callers can edit them without touching the cache.
+            taxons.setdefault(taxon["taxon_id"], dict(taxon))
+    return list(taxons.values())
+
+
+def _likely_lineage_ids(entity: Entity, taxa: tuple) -> list:
+    """Taxon ids the rank stage is likely to pick: the results named like the entity, else the first results."""
+    named = _named_like(entity, taxa)
+    return [taxon["taxon_id"] for taxon in (named or list(taxa))[:PREFETCH_LINEAGE_TOP]]
+
+
+def _prefetch(
+    entity: Entity, query_operator: str, include_sub_species: bool, index: str, include_lineage: bool, lineage: bool
+):
+    try:
+        taxa = entity_lookup(entity, query_operator, include_sub_species, index, include_lineage)
+        if lineage:
+            for taxon_id in _likely_lineage_ids(entity, taxa):
+                search_api_call(f"tax_name({taxon_id})", index, size=1)
+    except Exception as e:
+        # The stage that needs the lookup makes it again and reports the failure.
+        logger.debug(f"Prefetch failed for {query_operator} {entity}: {e}")
+
+
+def rank_cache_key(input: str, state: Dict[str, Any]) -> list:
+    """The rank stage only reads the query and its `tax_tree` candidates."""
+    candidates = query_entity(state, query_operator="tax_tree", include_sub_species=False)
+    return [normalize_query(input), state["index"]["classification"], sorted(t["taxon_id"] for t in candidates)]
+
+
+def attribute_cache_key(input: str, state: Dict[str, Any]) -> list:
+    """
+    The attribute stage only reads the query and the index.
+
+    Only case and whitespace are folded: `normalize_query` also folds
+    punctuation and plurals, which can change the constraints read from the query.
+    """
+    return [" ".join(input.casefold().split()), state["index"]["classification"]]
+
+
+def record_cache_key(input: str, state: Dict[str, Any]) -> list:
+    """The record stage only reads the query, the index and its `tax_name` candidates."""
+    candidates = query_entity(state, include_lineage=False)
+    return [normalize_query(input), state["index"]["classification"], sorted(t["taxon_id"] for t in candidates)]
+
+
+def prefetch_entity_lookups(state: Dict[str, Any]):
+    """
+    Start the GoaT lookups of the record or rank stage and `construct_query` once entities and index are known.
+
+    The lookups go through `entity_lookup`, so the stages later get the
+    result from its cache, or join the request still in flight through the
+    client's single-flight coalescing. Each state is prefetched for once, by
+    whichever of the entity and index stages finishes last. When the intent is
+    already known only its branch is prefetched; otherwise both are. Lookups
+    the local taxonomy store answers are skipped.
+    """
+    if not PREFETCH or "entity" not in state or "index" not in state:
+        return
+    launched: list = []
+    if state.setdefault("prefetch", launched) is not launched or not state["entity"].get("entities"):
+        return
+
+    index = state["index"]["classification"]
+    intent = state.get("intent", {}).get("intent")
+    lookups = []
+    # The same arguments as query_entity in identify_record and identify_rank, so the cache keys match.
+    if intent in (None, "record"):
+        lookups.append(("tax_name", True, False, False))
+    if intent != "record":
+        lookups.append(("tax_tree", False, True, PREFETCH_LINEAGE_TOP > 0))
+    for operator, include_sub_species, include_lineage, lineage in lookups:
+        entities = [
+            entity
+            for entity in _entity_keys(state)
+            if local_entity_lookup(entity, operator, include_sub_species, include_lineage) is None
+        ]
+        if not entities:
+            continue
+        registry.increment("goat_nlp_prefetch_total", "Speculative GoaT lookups started.", operator=operator)
+        for entity in entities:
+            launched.append(entity_search_query(entity, operator, include_sub_species))
+            # A fresh context keeps the lookup time out of the current stage's timings.
+            _prefetch_executor.submit(
+                _prefetch, entity, operator, include_sub_species, index, include_lineage, lineage
+            )
@@ -0,0 +1,130 @@
+"""
+Per-request deadlines.
+
+The app installs a `Deadline` for every translation with `use_deadline`. It
+lives in a context variable, so it follows the request into the parallel stage
+threads. LLM and GoaT calls clip their timeouts to the time left and raise
+`DeadlineExceeded` once it has run out, or once the deadline was cancelled
+because the client went away. Optional stages check `degrade` first and are
+skipped, rather than started, when less than their budget is left; they are
+listed in `state["degraded"]`.
+"""
+
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import wait as wait_futures
+from typing import Any, Dict, Optional
+
+from agent.metrics import registry
+from agent.prompt_budget import parse_stage_values
+
+logger = logging.getLogger("goat_nlp.deadline")
+
+# Seconds a translation may take; 0 disables the deadline.
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 120))
+# Seconds that must be left to run an optional step, e.g. "attribute=20,lineage=15".
+DEGRADE_BUDGETS = parse_stage_values(os.getenv("DEGRADE_BUDGETS", "attribute=20,lineage=15"))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request ran out of time or was cancelled."""
+
+
+class Deadline:
+    """
+    Time budget of one request, which can also be cancelled early.
+
+    Args:
+        seconds (float, optional): Time allowed from now; None or 0 for no limit.
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a limit."""
+        return None if self.expires_at is None else self.expires_at - time.monotonic()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextlib.contextmanager
+def use_deadline(deadline: Deadline):
+    """Apply `deadline` to every LLM and GoaT call made in this context."""
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None when it has no deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def check(what: str):
+    """
+    Raise if the current request has no time left for `what`.
+
+    Raises:
+        DeadlineExceeded: If the deadline passed or the request was cancelled.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return
+    if deadline.cancelled:
+        raise DeadlineExceeded(f"Request cancelled before {what}")
+    left = deadline.remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before {what}")
+
+
+def clip_timeout(timeout: float, what: str) -> float:
+    """`timeout` shortened to the time left for the current request."""
+    check(what)
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+
+def wait(future: Future, what: str) -> Any:
+    """
+    Wait for `future` while the current request has time left.
+
+    The work behind the future is not interrupted, only no longer waited for.
+
+    Raises:
+        DeadlineExceeded: If the deadline passed or the request was cancelled first.
+    """
+    if _deadline.get() is not None:
+        # Short waits, so a cancellation is noticed soon.
+        while not wait_futures([future], timeout=clip_timeout(0.25, what)).done:
+            pass
+    return future.result()
+
+
+def degrade(stage: str, state: Dict[str, Any]) -> bool:
+    """Whether to skip the optional `stage` for lack of time, recording it in `state["degraded"]` if so."""
+    budget = DEGRADE_BUDGETS.get(stage)
+    left = remaining()
+    if budget is None or left is None or left >= budget:
+        return False
+    logger.warning(f"Skipping {stage} with {left:.1f}s left of the request deadline")
+    registry.increment("goat_nlp_degraded_total", "Optional stages skipped for lack of time.", stage=stage)
+    state.setdefault("degraded", []).append(stage)
+    return True
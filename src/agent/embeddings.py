@@ -0,0 +1,34 @@
+import functools
+import logging
+import os
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger("goat_nlp.embeddings")
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-small-en-v1.5")
+
+
+@functools.lru_cache(maxsize=None)
+def get_embed_model():
+    """The local embedding model, loaded on first use."""
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    logger.info(f"Loading embedding model {EMBED_MODEL}")
+    return HuggingFaceEmbedding(model_name=EMBED_MODEL)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Unit-length embeddings for documents, one row per text."""
+    return _normalize(np.asarray(get_embed_model().get_text_embedding_batch(texts), dtype=np.float32))
+
+
+def embed_query(text: str) -> np.ndarray:
+    """Unit-length embedding for a query, comparable with `embed_texts` by dot product."""
+    return _normalize(np.asarray(get_embed_model().get_query_embedding(text), dtype=np.float32))
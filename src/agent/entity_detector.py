@@ -0,0 +1,394 @@
+"""
+Dictionary-based detection of organism names in queries.
+
+`identify_entity` asks this detector first and only runs ENTITY_PROMPT when it
+finds no confident match. Names are matched as a token trie: every name is
+casefolded, split into words and each word reduced to its singular form, so
+"Fruit flies", "fruit fly" and "FRUIT-FLY" are the same key. The trie is stored
+as the sorted 64-bit hashes of every word prefix of every key, so a lexicon
+built from a full taxonomy dump is a few flat arrays, opened with `mmap` and
+shared by every worker process, and matching a query is a binary search per
+word read.
+
+Without `ENTITY_LEXICON_PATH` the detector uses the built-in `SEED_ENTITIES`
+(the taxa of `scripts/generate_query_dataset.py` and common groups). A lexicon
+built from an NCBI taxdump or a GoaT taxon dump extends it:
+
+Usage:
+    python -m agent.entity_detector --out models/entity_lexicon
+    python -m agent.entity_detector --out models/entity_lexicon ncbi --nodes nodes.dmp --names names.dmp
+    python -m agent.entity_detector --out models/entity_lexicon goat --dump taxa.jsonl
+"""
+
+import argparse
+import functools
+import hashlib
+import itertools
+import logging
+import mmap
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from agent.metrics import registry
+from agent.response_cache import singularize
+from agent.taxonomy import TaxonRow, read_goat_dump, read_ncbi_taxdump
+
+logger = logging.getLogger("goat_nlp.entity_detector")
+
+ENTITY_DETECTOR = os.getenv("ENTITY_DETECTOR", "true").lower() == "true"
+# Longest name, in words, that is matched.
+MAX_NAME_TOKENS = 6
+
+# (singular_form, plural_form, scientific_name), as ENTITY_PROMPT returns them.
+SEED_ENTITIES = [
+    # scripts/generate_query_dataset.py
+    ("bat", "bats", "Chiroptera"),
+    ("cat", "cats", "Felidae"),
+    ("gnat", "gnats", "Nematocera"),
+    ("rat", "rats", "Rattus"),
+    ("spider", "spiders", "Araneae"),
+    ("Borneo magnolia", "Borneo magnolias", "Borneo magnolia"),
+    ("mushroom", "mushrooms", "Agaricomycetes"),
+    ("bird", "birds", "Aves"),
+    ("rodent", "rodents", "Rodentia"),
+    ("human", "humans", "Homo sapiens"),
+    ("wolf", "wolves", "Canis lupus"),
+    ("fruit fly", "fruit flies", "Drosophila"),
+    ("primate", "primates", "Primates"),
+    ("cattle", "cattle", "Bos taurus"),
+    ("fungus", "fungi", "Fungi"),
+    ("reptile", "reptiles", "Reptilia"),
+    # Common groups
+    ("animal", "animals", "Metazoa"),
+    ("plant", "plants", "Viridiplantae"),
+    ("flowering plant", "flowering plants", "Magnoliopsida"),
+    ("mammal", "mammals", "Mammalia"),
+    ("amphibian", "amphibians", "Amphibia"),
+    ("frog", "frogs", "Anura"),
+    ("snake", "snakes", "Serpentes"),
+    ("turtle", "turtles", "Testudines"),
+    ("insect", "insects", "Insecta"),
+    ("beetle", "beetles", "Coleoptera"),
+    ("butterfly", "butterflies", "Papilionoidea"),
+    ("ant", "ants", "Formicidae"),
+    ("mosquito", "mosquitoes", "Culicidae"),
+    ("arthropod", "arthropods", "Arthropoda"),
+    ("crustacean", "crustaceans", "Crustacea"),
+    ("mollusc", "molluscs", "Mollusca"),
+    ("snail", "snails", "Gastropoda"),
+    ("nematode", "nematodes", "Nematoda"),
+    ("vertebrate", "vertebrates", "Vertebrata"),
+    ("whale", "whales", "Cetacea"),
+    ("dog", "dogs", "Canis lupus familiaris"),
+    ("mouse", "mice", "Mus musculus"),
+    ("chicken", "chickens", "Gallus gallus"),
+    ("grass", "grasses", "Poaceae"),
+    ("orchid", "orchids", "Orchidaceae"),
+    ("bacterium", "bacteria", "Bacteria"),
+    # "<x> family" names the family, not the species the bare noun maps to (as in RANK_PROMPT's example).
+    ("dog family", "dog families", "Canidae"),
+    ("cat family", "cat families", "Felidae"),
+    ("mouse family", "mouse families", "Muridae"),
+    ("horse family", "horse families", "Equidae"),
+    ("deer family", "deer families", "Cervidae"),
+    ("bear family", "bear families", "Ursidae"),
+    ("crow family", "crow families", "Corvidae"),
+    ("grass family", "grass families", "Poaceae"),
+    ("orchid family", "orchid families", "Orchidaceae"),
+    ("rose family", "rose families", "Rosaceae"),
+]
+
+# Words that are never an entity on their own, even where a taxonomy has a taxon named like them: the words of
+# the domain and of the way queries are asked. Any other word left unmatched may name an organism.
+STOP_WORDS = set(
+    """
+    species subspecies genus genera family families order class phylum kingdom rank taxon taxa genome genomes
+    assembly assemblies sample samples data sequence sequencing sequenced platform platforms record records
+    number count size span level chromosome chromosomes status information date year month recent recently
+    many what which how have been the and for with all any are rna dna seq read reads available produced
+    updated include does
+
+    organism lineage tree clade group kind type member members
+    busco completeness contig contigs scaffold scaffolds gc content length ploidy karyotype haploid diploid
+    mitochondrial mitochondrion weight mass body lifespan longevity age maturity egg habitat biome
+    country location latitude longitude elevation accession bioproject biosample project projects tolid
+    reference annotation annotated annotations gene genes protein proteins coverage quality long short
+    pacbio nanopore illumina hic hifi metadata field fields attribute attributes value values result results
+    collected collection sampled sequence submitted released published publication open progress planned
+    insdc ncbi ena ebp dtol database
+
+    a an of in on to at by as or nor not no yes is be am was were being do did done has had having there
+    their them they theirs it its this that these those who whom whose where when why so far than then
+    too very also only just even still yet ever more most less least fewer greater larger smaller bigger
+    higher lower above below over under between among within without from into onto out up down off about
+    after before since until till during per each every both either neither other another such same own
+    some few several much one two three four five six seven eight nine ten hundred thousand million billion
+    first last next latest newest oldest earliest past current currently now today yesterday ago day week
+    decade new old exactly equal missing known unknown
+    i me my we us our you your please can could would should will shall may might must let
+    give show list find get tell know want need see look search return display fetch lookup compare
+    here total overall across including excluding includes included use used using contain contains containing
+    exist exists belong belonging related
+    """.split()
+)
+
+_TOKEN = re.compile(r"[^\W_]+")
+# Names in a taxonomy dump that do not name an organism group someone would ask about.
+_SKIP_NAME = re.compile(
+    r"[\d,;:()\[\]\"/]|\b(?:unclassified|uncultured|unidentified|environmental|sp|cf|aff)\b", re.I
+)
+
+
+def plural(name: str) -> str:
+    if name.endswith("y") and not name.endswith(("ay", "ey", "oy", "uy")):
+        return name[:-1] + "ies"
+    if name.endswith(("s", "x", "z", "ch", "sh")):
+        return name + "es"
+    return name + "s"
+
+
+def name_key(name: str) -> str:
+    return " ".join(singularize(word) for word in _TOKEN.findall(name.casefold()))
+
+
+STOP_KEYS = {name_key(word) for word in STOP_WORDS}
+
+
+def _step(prefix_hash: int, word: str) -> int:
+    """Hash of a key prefix extended by one word; stable across processes, unlike `hash`."""
+    digest = hashlib.blake2b(prefix_hash.to_bytes(8, "little") + word.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class EntityLexicon:
+    """
+    Token trie over organism names, as sorted prefix hashes.
+
+    Args:
+        prefixes (np.ndarray): Sorted hashes of every word prefix of every key (uint64).
+        prefix_entries (np.ndarray): Entry whose key ends at each prefix, or -1 (int32).
+        entry_offsets (np.ndarray): Offsets of each entry in `entry_blob`.
+        entry_blob (bytes-like): Tab-separated key, singular, plural, scientific name and strict flag per entry.
+    """
+
+    def __init__(self, prefixes: np.ndarray, prefix_entries: np.ndarray, entry_offsets: np.ndarray, entry_blob):
+        self.prefixes = prefixes
+        self.prefix_entries = prefix_entries
+        self.entry_offsets = entry_offsets
+        self.entry_blob = entry_blob
+
+    @classmethod
+    def build(cls, entries: Iterable[Tuple[str, str, str, str, bool]]) -> "EntityLexicon":
+        """
+        Build a lexicon in memory.
+
+        Args:
+            entries: (name, singular, plural, scientific name, strict) per name to match. The
+                first entry of a key wins. Strict entries only match capitalized in the query.
+        """
+        keys: Dict[str, int] = {}
+        blob = []
+        for name, singular_form, plural_form, scientific_name, strict in entries:
+            key = name_key(name)
+            words = key.split()
+            if not words or len(words) > MAX_NAME_TOKENS or key in keys or (len(words) == 1 and len(key) < 3):
+                continue
+            keys[key] = len(blob)
+            blob.append(
+                "\t".join((key, singular_form, plural_form, scientific_name, "1" if strict else "0")).encode()
+            )
+
+        prefix_entries: Dict[int, int] = {}
+        for key, entry in keys.items():
+            prefix_hash = 0
+            for word in key.split():
+                prefix_hash = _step(prefix_hash, word)
+                prefix_entries.setdefault(prefix_hash, -1)
+            prefix_entries[prefix_hash] = entry
+        prefixes = np.array(sorted(prefix_entries), dtype=np.uint64)
+        entry_offsets = np.zeros(len(blob) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in blob], out=entry_offsets[1:])
+        return cls(
+            prefixes,
+            np.array([prefix_entries[int(prefix)] for prefix in prefixes], dtype=np.int32),
+            entry_offsets,
+            b"".join(blob),
+        )
+
+    def save(self, out_dir: str):
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, "prefixes.npy"), self.prefixes)
+        np.save(os.path.join(out_dir, "prefix_entries.npy"), self.prefix_entries)
+        np.save(os.path.join(out_dir, "entry_offsets.npy"), self.entry_offsets)
+        with open(os.path.join(out_dir, "entries.bin"), "wb") as blob_file:
+            # mmap cannot map an empty file
+            blob_file.write(bytes(self.entry_blob) or b"\0")
+        logger.info(f"Saved entity lexicon with {len(self)} names and {len(self.prefixes)} prefixes to {out_dir}")
+
+    @classmethod
+    def load(cls, path: str) -> "EntityLexicon":
+        with open(os.path.join(path, "entries.bin"), "rb") as blob_file:
+            entry_blob = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(
+            np.load(os.path.join(path, "prefixes.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "prefix_entries.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "entry_offsets.npy"), mmap_mode="r"),
+            entry_blob,
+        )
+
+    def __len__(self) -> int:
+        return len(self.entry_offsets) - 1
+
+    def _entry(self, entry: int) -> List[str]:
+        return self.entry_blob[self.entry_offsets[entry] : self.entry_offsets[entry + 1]].decode().split("\t")
+
+    def _find(self, prefix_hash: int) -> Optional[int]:
+        position = int(np.searchsorted(self.prefixes, np.uint64(prefix_hash)))
+        if position < len(self.prefixes) and int(self.prefixes[position]) == prefix_hash:
+            return position
+        return None
+
+    def match(self, text: str) -> Tuple[List[Dict[str, str]], List[str]]:
+        """
+        Longest, leftmost non-overlapping names in `text`.
+
+        Returns:
+            tuple: The entities, shaped like ENTITY_PROMPT's, and the words that
+            matched no name and are not in `STOP_WORDS`, other than acronyms and numbers.
+        """
+        words = [(word, singularize(word.casefold())) for word in _TOKEN.findall(text)]
+        entities: Dict[str, Dict[str, str]] = {}
+        unmatched = []
+        start = 0
+        while start < len(words):
+            prefix_hash, best = 0, None
+            for end in range(start, min(len(words), start + MAX_NAME_TOKENS)):
+                prefix_hash = _step(prefix_hash, words[end][1])
+                position = self._find(prefix_hash)
+                if position is None:
+                    break
+                if self.prefix_entries[position] >= 0:
+                    best = (end + 1, int(self.prefix_entries[position]))
+            if best is not None:
+                end, entry = best
+                key, singular_form, plural_form, scientific_name, strict = self._entry(entry)
+                if (
+                    # Guards against hash collisions.
+                    key == " ".join(word for _, word in words[start:end])
+                    and not (end - start == 1 and key in STOP_KEYS)
+                    and not (strict == "1" and not words[start][0][:1].isupper())
+                ):
+                    entities.setdefault(
+                        scientific_name,
+                        {
+                            "singular_form": singular_form,
+                            "plural_form": plural_form,
+                            "scientific_name": scientific_name,
+                        },
+                    )
+                    start = end
+                    continue
+            word, key = words[start]
+            if len(key) > 2 and key not in STOP_KEYS and not word.isupper() and not any(c.isdigit() for c in key):
+                unmatched.append(word)
+            start += 1
+        return list(entities.values()), unmatched
+
+
+def seed_entries() -> Iterator[Tuple[str, str, str, str, bool]]:
+    for singular_form, plural_form, scientific_name in SEED_ENTITIES:
+        for name in (singular_form, plural_form, scientific_name):
+            yield name, singular_form, plural_form, scientific_name, False
+
+
+def taxonomy_entries(rows: Iterable[TaxonRow]) -> Iterator[Tuple[str, str, str, str, bool]]:
+    """
+    Entries for every usable name in a taxonomy dump, higher taxa first.
+
+    A name shared by several taxa therefore resolves to the broadest of them
+    (e.g. a common name used for a whole order and one of its genera).
+    Single-word scientific names only match when capitalized, so genera named
+    like English words are not picked up from ordinary text.
+    """
+    rows = list(rows)
+    parents = {taxon_id: parent for taxon_id, parent, _, _, _ in rows}
+    depths: Dict[int, int] = {}
+    for taxon_id in parents:
+        path = []
+        while taxon_id not in depths and parents.get(taxon_id, taxon_id) != taxon_id and len(path) < 200:
+            path.append(taxon_id)
+            taxon_id = parents[taxon_id]
+        depth = depths.setdefault(taxon_id, 0)
+        for ancestor in reversed(path):
+            depth += 1
+            depths[ancestor] = depth
+
+    for taxon_id, _, _, scientific_name, other_names in sorted(rows, key=lambda row: depths.get(row[0], 0)):
+        if not scientific_name or _SKIP_NAME.search(scientific_name):
+            continue
+        yield scientific_name, scientific_name, scientific_name, scientific_name, " " not in scientific_name
+        for name in other_names:
+            if _SKIP_NAME.search(name):
+                continue
+            if name[:1].isupper():
+                yield name, name, name, scientific_name, " " not in name
+            else:
+                singular_form = " ".join(name.split()[:-1] + [singularize(name.split()[-1])])
+                plural_form = name if singular_form != name else plural(name)
+                yield name, singular_form, plural_form, scientific_name, False
+
+
+@functools.lru_cache(maxsize=None)
+def get_entity_lexicon() -> EntityLexicon:
+    """The lexicon at `ENTITY_LEXICON_PATH`, else the seed lexicon."""
+    path = os.getenv("ENTITY_LEXICON_PATH")
+    if path:
+        try:
+            lexicon = EntityLexicon.load(path)
+            logger.info(f"Opened entity lexicon with {len(lexicon)} names at {path}")
+            return lexicon
+        except (OSError, ValueError):
+            logger.exception(f"Could not open entity lexicon at {path}, using the seed names only")
+    return EntityLexicon.build(seed_entries())
+
+
+def detect_entities(query: str) -> Optional[List[Dict[str, str]]]:
+    """
+    The organisms named in `query`, or None when the LLM should decide.
+
+    A match is not trusted when any other content word is left unmatched, as
+    it may name an organism the lexicon does not know ("tardigrades and mammals").
+    """
+    if not ENTITY_DETECTOR:
+        return None
+    entities, unmatched = get_entity_lexicon().match(query)
+    hit = bool(entities) and not unmatched
+    registry.increment(
+        "goat_nlp_entity_detector_total",
+        "Entity detector results; fallbacks go to the LLM.",
+        result="hit" if hit else "fallback",
+    )
+    return entities if hit else None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the entity lexicon from the seed names and a taxonomy dump.")
+    parser.add_argument("--out", required=True, help="Output directory")
+    subparsers = parser.add_subparsers(dest="source")
+    ncbi_parser = subparsers.add_parser("ncbi", help="Add the names of an NCBI taxdump")
+    ncbi_parser.add_argument("--nodes", required=True, help="Path to nodes.dmp")
+    ncbi_parser.add_argument("--names", required=True, help="Path to names.dmp")
+    goat_parser = subparsers.add_parser("goat", help="Add the names of a GoaT taxon dump (JSON lines)")
+    goat_parser.add_argument("--dump", required=True, help="Path to the JSON lines dump")
+    args = parser.parse_args()
+
+    entries = seed_entries()
+    if args.source == "ncbi":
+        entries = itertools.chain(entries, taxonomy_entries(read_ncbi_taxdump(args.nodes, args.names)))
+    elif args.source == "goat":
+        entries = itertools.chain(entries, taxonomy_entries(read_goat_dump(args.dump)))
+    EntityLexicon.build(entries).save(args.out)
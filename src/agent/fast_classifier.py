@@ -0,0 +1,196 @@
+"""
+Local naive Bayes classifier for the intent and index stages.
+
+Trained from `queries/script_generated_queries.json`. When its confidence is
+above `FAST_CLASSIFIER_THRESHOLD` and the query is mostly made of words seen in
+training, `identify_intent`/`identify_index` use its label and skip the LLM.
+
+Usage:
+    python -m agent.fast_classifier --data queries/script_generated_queries.json --out models/fast_classifier.json
+"""
+
+import argparse
+import functools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import urllib.parse
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from agent.response_cache import normalize_query
+
+logger = logging.getLogger("goat_nlp.fast_classifier")
+
+TASKS = ("intent", "index")
+FAST_CLASSIFIER_THRESHOLD = float(os.getenv("FAST_CLASSIFIER_THRESHOLD", 0.95))
+# Share of the query's features that must have been seen in training.
+FAST_CLASSIFIER_MIN_COVERAGE = float(os.getenv("FAST_CLASSIFIER_MIN_COVERAGE", 0.8))
+
+
+def features(query: str) -> List[str]:
+    tokens = normalize_query(query).split()
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def labels_from_example(example: Dict) -> Dict[str, str]:
+    """
+    Intent and index labels for one generated example.
+
+    The generator never emits `result=sample`, so queries about samples are
+    labelled `sample` to match the examples in INDEX_PROMPT. Queries with a time
+    frame are labelled `assembly`, as `construct_query` switches to that index.
+    """
+    query_params = urllib.parse.parse_qs(urllib.parse.urlparse(example["api_query"]).query)
+    index = query_params.get("result", ["taxon"])[0]
+    if "time_frame_query" in example["json_output"]:
+        index = "assembly"
+    if "sample" in normalize_query(example["english_query"]).split():
+        index = "sample"
+    return {"intent": example["json_output"]["intent"], "index": index}
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over unigram and bigram features, with add-one smoothing."""
+
+    def __init__(self, class_counts: Dict[str, int], feature_counts: Dict[str, Dict[str, int]]):
+        self.class_counts = class_counts
+        self.feature_counts = feature_counts
+        self.vocabulary = {feature for counts in feature_counts.values() for feature in counts}
+        total = sum(class_counts.values())
+        self.log_priors = {label: math.log(count / total) for label, count in class_counts.items()}
+        self.log_denominators = {
+            label: math.log(sum(counts.values()) + len(self.vocabulary)) for label, counts in feature_counts.items()
+        }
+
+    @classmethod
+    def train(cls, examples: Iterable[Tuple[str, str]]) -> "NaiveBayes":
+        class_counts: Counter = Counter()
+        feature_counts: Dict[str, Counter] = {}
+        for query, label in examples:
+            class_counts[label] += 1
+            feature_counts.setdefault(label, Counter()).update(features(query))
+        return cls(dict(class_counts), {label: dict(counts) for label, counts in feature_counts.items()})
+
+    def predict(self, query: str) -> Tuple[str, float, float]:
+        """The most likely label, its posterior probability and the share of known features."""
+        query_features = features(query)
+        known = [feature for feature in query_features if feature in self.vocabulary]
+        scores = {
+            label: self.log_priors[label]
+            + sum(
+                math.log(self.feature_counts[label].get(feature, 0) + 1) - self.log_denominators[label]
+                for feature in known
+            )
+            for label in self.class_counts
+        }
+        best = max(scores, key=scores.get)
+        probability = 1 / sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, probability, len(known) / max(len(query_features), 1)
+
+    def to_dict(self) -> Dict:
+        return {"class_counts": self.class_counts, "feature_counts": self.feature_counts}
+
+
+class FastClassifier:
+    """
+    Per-task classifiers plus hit/fallback counters.
+
+    Args:
+        models (dict): Task name -> trained `NaiveBayes`.
+        threshold (float): Minimum posterior probability to accept a label.
+        min_coverage (float): Minimum share of query features seen in training.
+    """
+
+    def __init__(self, models: Dict[str, NaiveBayes], threshold: float, min_coverage: float):
+        self.models = models
+        self.threshold = threshold
+        self.min_coverage = min_coverage
+        self._lock = threading.Lock()
+        self._counts = {task: {"hits": 0, "fallbacks": 0} for task in models}
+
+    @classmethod
+    def load(cls, path: str) -> "FastClassifier":
+        with open(path) as model_file:
+            data = json.load(model_file)
+        models = {task: NaiveBayes(**model) for task, model in data["tasks"].items()}
+        return cls(models, FAST_CLASSIFIER_THRESHOLD, FAST_CLASSIFIER_MIN_COVERAGE)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as model_file:
+            json.dump({"tasks": {task: model.to_dict() for task, model in self.models.items()}}, model_file)
+
+    def classify(self, task: str, query: str) -> Optional[Tuple[str, float]]:
+        """The label and its probability for `task`, or None when the LLM should decide."""
+        if task not in self.models:
+            return None
+        label, probability, coverage = self.models[task].predict(query)
+        hit = probability >= self.threshold and coverage >= self.min_coverage
+        with self._lock:
+            self._counts[task]["hits" if hit else "fallbacks"] += 1
+        return (label, probability) if hit else None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Hits, fallbacks and hit rate per task since the process started."""
+        with self._lock:
+            return {
+                task: {**counts, "hit_rate": counts["hits"] / max(counts["hits"] + counts["fallbacks"], 1)}
+                for task, counts in self._counts.items()
+            }
+
+
+@functools.lru_cache(maxsize=None)
+def get_fast_classifier() -> Optional[FastClassifier]:
+    """The classifier at `FAST_CLASSIFIER_PATH`, or None when the fast path is disabled."""
+    path = os.getenv("FAST_CLASSIFIER_PATH")
+    if not path:
+        return None
+    try:
+        classifier = FastClassifier.load(path)
+    except (OSError, ValueError, KeyError):
+        logger.exception(f"Could not load fast classifier from {path}, using the LLM only")
+        return None
+    logger.info(f"Loaded fast classifier from {path}")
+    return classifier
+
+
+def fast_classify(task: str, query: str) -> Optional[Tuple[str, float]]:
+    classifier = get_fast_classifier()
+    return classifier.classify(task, query) if classifier is not None else None
+
+
+def train(examples: List[Dict], holdout: float = 0.2, seed: int = 0) -> Tuple[FastClassifier, Dict[str, float]]:
+    """Train on `examples` and report accuracy and hit rate on a random hold-out split."""
+    examples = list(examples)
+    random.Random(seed).shuffle(examples)
+    split = int(len(examples) * (1 - holdout))
+    labelled = [(example["english_query"], labels_from_example(example)) for example in examples]
+
+    report = {}
+    for task in TASKS:
+        model = NaiveBayes.train((query, labels[task]) for query, labels in labelled[:split])
+        evaluation = FastClassifier({task: model}, FAST_CLASSIFIER_THRESHOLD, FAST_CLASSIFIER_MIN_COVERAGE)
+        predictions = [(evaluation.classify(task, query), labels[task]) for query, labels in labelled[split:]]
+        hits = [(prediction[0], label) for prediction, label in predictions if prediction is not None]
+        report[f"{task}_hit_rate"] = len(hits) / max(len(predictions), 1)
+        report[f"{task}_hit_accuracy"] = sum(label == expected for label, expected in hits) / max(len(hits), 1)
+
+    models = {task: NaiveBayes.train((query, labels[task]) for query, labels in labelled) for task in TASKS}
+    return FastClassifier(models, FAST_CLASSIFIER_THRESHOLD, FAST_CLASSIFIER_MIN_COVERAGE), report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Train the fast-path intent/index classifier.")
+    parser.add_argument("--data", default="queries/script_generated_queries.json", help="Labelled query dataset")
+    parser.add_argument("--out", default="models/fast_classifier.json", help="Where to write the model")
+    args = parser.parse_args()
+
+    with open(args.data) as data_file:
+        classifier, report = train(json.load(data_file))
+    classifier.save(args.out)
+    logger.info(f"Saved fast classifier to {args.out}: {json.dumps(report)}")
@@ -0,0 +1,183 @@
+import functools
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future
+from typing import Any, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from agent.deadline import DeadlineExceeded, check, clip_timeout, remaining, wait
+from agent.metrics import add_stage_time, registry
+
+logger = logging.getLogger("goat_nlp.goat_client")
+
+
+class GoatAPIError(Exception):
+    """Raised when a GoaT API request fails after all retries."""
+
+
+class _RetryableStatus(Exception):
+    pass
+
+
+class GoatClient:
+    """
+    Pooled, retrying client for the GoaT API.
+
+    - One keep-alive `requests.Session` with a bounded connection pool.
+    - Connect/read timeouts on every request.
+    - Retries with jittered exponential backoff on 5xx responses, connection
+      errors and timeouts.
+    - Single-flight coalescing: concurrent calls for the same URL share one
+      in-flight request and all receive its result.
+    - Per-endpoint counters of requests, bytes, retries and errors (`stats()`).
+
+    Args:
+        base_url (str): GoaT API base URL, e.g. https://goat.genomehubs.org/api/v2
+        connect_timeout (float): Seconds to wait for a connection.
+        read_timeout (float): Seconds to wait for the response.
+        max_retries (int): Retries after the first attempt.
+        backoff (float): Base backoff in seconds, doubled on every retry.
+        pool_size (int): Maximum pooled connections to the API host.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        pool_size: int = 16,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_env(cls) -> "GoatClient":
+        return cls(
+            os.getenv("GOAT_BASE_URL", "https://goat.genomehubs.org/api/v2"),
+            connect_timeout=float(os.getenv("GOAT_CONNECT_TIMEOUT", 5.0)),
+            read_timeout=float(os.getenv("GOAT_READ_TIMEOUT", 30.0)),
+            max_retries=int(os.getenv("GOAT_MAX_RETRIES", 3)),
+            backoff=float(os.getenv("GOAT_BACKOFF", 0.5)),
+            pool_size=int(os.getenv("GOAT_POOL_SIZE", 16)),
+        )
+
+    def url(self, endpoint: str, params: Dict[str, Any]) -> str:
+        return f"{self.base_url}/{endpoint}?" + urllib.parse.urlencode(params, quote_via=urllib.parse.quote)
+
+    def get_json(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        GET `endpoint` with `params` and return the parsed JSON body.
+
+        Raises:
+            GoatAPIError: If the request still fails after all retries.
+            DeadlineExceeded: If the request deadline passed first.
+        """
+        url = self.url(endpoint, params)
+        start = time.perf_counter()
+        try:
+            return self._get_json(endpoint, url)
+        finally:
+            latency = time.perf_counter() - start
+            add_stage_time("goat", latency)
+            registry.observe(
+                "goat_nlp_goat_api_seconds",
+                "Latency of a GoaT API call, including retries.",
+                latency,
+                endpoint=endpoint,
+            )
+
+    def _get_json(self, endpoint: str, url: str) -> Dict[str, Any]:
+        while True:
+            with self._lock:
+                future = self._in_flight.get(url)
+                leader = future is None
+                if leader:
+                    future = self._in_flight[url] = Future()
+            if leader:
+                break
+
+            self._count(endpoint, "coalesced")
+            try:
+                return wait(future, f"GoaT {endpoint} request")
+            except DeadlineExceeded:
+                # The leader may have run out of its own time; only give up when this request has too.
+                check(f"GoaT {endpoint} request")
+
+        try:
+            result, exception = self._fetch(endpoint, url), None
+        except Exception as e:
+            result, exception = None, e
+        with self._lock:
+            # Removed before the followers wake up, so one that retries starts a new request.
+            del self._in_flight[url]
+        if exception is not None:
+            future.set_exception(exception)
+            raise exception
+        future.set_result(result)
+        return result
+
+    def _fetch(self, endpoint: str, url: str) -> Dict[str, Any]:
+        last_exception = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count(endpoint, "retries")
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                time.sleep(max(0.0, min(delay, remaining() or delay)))
+            what = f"GoaT {endpoint} request"
+            try:
+                self._count(endpoint, "requests")
+                response = self.session.get(
+                    url, timeout=(clip_timeout(self.timeout[0], what), clip_timeout(self.timeout[1], what))
+                )
+                self._count(endpoint, "bytes", len(response.content))
+                if response.status_code >= 500:
+                    raise _RetryableStatus(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                return response.json()
+            except (_RetryableStatus, requests.ConnectionError, requests.Timeout) as e:
+                logger.warning(f"GoaT {endpoint} request failed (attempt {attempt + 1}): {e}")
+                last_exception = e
+            except requests.RequestException as e:
+                self._count(endpoint, "errors")
+                raise GoatAPIError(f"GoaT {endpoint} request failed: {e}") from e
+
+        self._count(endpoint, "errors")
+        raise GoatAPIError(
+            f"GoaT {endpoint} request failed after {self.max_retries + 1} attempts"
+        ) from last_exception
+
+    def _count(self, endpoint: str, counter: str, value: int = 1):
+        with self._lock:
+            counters = self._stats.setdefault(
+                endpoint, {"requests": 0, "bytes": 0, "retries": 0, "errors": 0, "coalesced": 0}
+            )
+            counters[counter] += value
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Request, byte, retry, error and coalesced-call counts per endpoint."""
+        with self._lock:
+            return {endpoint: dict(counters) for endpoint, counters in self._stats.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def get_goat_client() -> GoatClient:
+    return GoatClient.from_env()
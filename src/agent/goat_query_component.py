@@ -1,11 +1,113 @@
-from typing import Any, Callable, Dict
+import contextvars
+import copy
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
 
 from llama_index.core.query_pipeline import CustomQueryComponent
 from pydantic import Field
 
+from agent.admission import AdmissionRejected
+from agent.component_helpers import STAGE_OUTPUTS
+from agent.deadline import DeadlineExceeded
+from agent.goat_client import GoatAPIError
+from agent.metrics import run_stage
+from agent.progress import report_stage
+from agent.prompt_budget import parse_stage_values
+from agent.stage_cache import count, get_stage_cache, hash_key
+
+logger = logging.getLogger("goat_nlp.goat_query_component")
+
+# Shared by every pipeline run in the process, so the total number of stage
+# threads stays bounded no matter how many requests are in flight.
+_stage_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PIPELINE_MAX_WORKERS", 8)),
+    thread_name_prefix="goat_stage",
+)
+
+# Retries of a failing stage before the pipeline gives up, e.g. "attribute=2,lineage=2".
+STAGE_RETRY_LIMIT = int(os.getenv("STAGE_RETRY_LIMIT", 2))
+STAGE_RETRY_LIMITS = parse_stage_values(os.getenv("STAGE_RETRY_LIMITS", ""))
+
+
+def _restore(stage: str, state: Dict[str, Any], checkpoint: Dict[str, Any]):
+    for key in STAGE_OUTPUTS.get(stage, ()):
+        if key in checkpoint:
+            state[key] = copy.deepcopy(checkpoint[key])
+        else:
+            state.pop(key, None)
+
+
+def _stage_cache_key(stage: str, cache_key: Optional[Callable], input: str, state: Dict[str, Any]) -> Optional[str]:
+    if cache_key is None or get_stage_cache() is None:
+        return None
+    try:
+        return hash_key(stage, cache_key(input, state))
+    except Exception as e:
+        # The stage itself runs into the same problem and reports it.
+        logger.warning(f"No stage cache key for {stage}: {e}")
+        return None
+
+
+def run_and_report(stage: str, fn: Callable, input: str, state: Dict[str, Any], cache_key: Optional[Callable] = None):
+    """
+    Run a stage, retrying it from its checkpoint within its retry budget.
+
+    Only the keys the stage writes are checkpointed and restored, so stages
+    running concurrently on the same state are not affected. Retries used are
+    recorded in `state["retries"][stage]`. The outputs (or the final error) are
+    reported to any progress listener.
+
+    With a `cache_key` function and a stage cache configured, the outputs are
+    memoized under the key it returns; hits are recorded in `state["stage_cache"]`.
+    """
+    key = _stage_cache_key(stage, cache_key, input, state)
+    if key is not None:
+        outputs = get_stage_cache().get(stage, key)
+        count(stage, "miss" if outputs is None else "hit")
+        if outputs is not None:
+            state.update(outputs)
+            state.setdefault("stage_cache", {})[stage] = "hit"
+            report_stage(stage, state)
+            return
+
+    checkpoint = {key: copy.deepcopy(state[key]) for key in STAGE_OUTPUTS.get(stage, ()) if key in state}
+    budget = STAGE_RETRY_LIMITS.get(stage, STAGE_RETRY_LIMIT)
+    for attempt in range(budget + 1):
+        try:
+            run_stage(stage, fn, input, state)
+            break
+        except Exception as e:
+            _restore(stage, state, checkpoint)
+            if isinstance(e, AdmissionRejected):
+                state["overloaded"] = e.status
+            if isinstance(e, DeadlineExceeded):
+                state["deadline_exceeded"] = True
+            # The GoaT client has already retried its own requests, retrying a rejection adds to the overload,
+            # and there is no time left for a retry after the deadline.
+            if attempt == budget or isinstance(e, (GoatAPIError, AdmissionRejected, DeadlineExceeded)):
+                report_stage(stage, state, str(e))
+                raise
+            state.setdefault("retries", {})[stage] = attempt + 1
+            logger.warning(f"Retrying stage {stage} ({attempt + 1}/{budget}): {e}")
+    # A stage skipped for lack of time is not memoized.
+    if key is not None and stage not in state.get("degraded", ()):
+        get_stage_cache().put(stage, key, {k: state[k] for k in STAGE_OUTPUTS.get(stage, ()) if k in state})
+    report_stage(stage, state)
+
+
+def _skipped(input: Dict[str, Any]) -> Dict[str, Any]:
+    """Pass an upstream failure through without running the stage."""
+    return {"output": {key: input[key] for key in ("error", "exception", "input", "state")}}
+
 
 class GoatQueryComponent(CustomQueryComponent):
+    stage: str = Field(..., description="Stage name used in metrics and progress events")
     fn: Callable = Field(..., description="Function to run")
+    cache_key: Optional[Callable] = Field(
+        default=None, description="Opt-in memoization: returns what the stage's outputs depend on"
+    )
 
     @property
     def _input_keys(self) -> set:
@@ -18,13 +120,19 @@ class GoatQueryComponent(CustomQueryComponent):
 
     def _run_component(self, **kwargs) -> Dict[str, Any]:
         """Run the component."""
+        if kwargs["input"].get("error"):
+            return _skipped(kwargs["input"])
+
         error = False
         exception = None
         try:
-            self.fn(kwargs["input"]["input"], kwargs["input"]["state"])
+            run_and_report(
+                self.stage, self.fn, kwargs["input"]["input"], kwargs["input"]["state"], cache_key=self.cache_key
+            )
         except Exception as e:
             error = True
-            exception = str(e)
+            exception = f"{self.stage}: {e}"
+            kwargs["input"]["state"]["failed_stage"] = self.stage
 
         return {
             "output": {
@@ -34,3 +142,57 @@ class GoatQueryComponent(CustomQueryComponent):
                 "state": kwargs["input"]["state"],
             }
         }
+
+
+class GoatParallelComponent(CustomQueryComponent):
+    """
+    Runs several independent stage functions concurrently and joins on all of them.
+
+    The functions share the same `state` dict, so each of them must only write
+    its own key(s) and must not read keys written by the others.
+    """
+
+    fns: Dict[str, Callable] = Field(..., description="Independent functions to run concurrently, by stage name")
+    cache_keys: Dict[str, Callable] = Field(
+        default_factory=dict, description="Opt-in memoization key functions, by stage name"
+    )
+
+    @property
+    def _input_keys(self) -> set:
+        """Input keys dict."""
+        return {"input"}
+
+    @property
+    def _output_keys(self) -> set:
+        return {"output"}
+
+    def _run_component(self, **kwargs) -> Dict[str, Any]:
+        """Run the component."""
+        if kwargs["input"].get("error"):
+            return _skipped(kwargs["input"])
+
+        input = kwargs["input"]["input"]
+        state = kwargs["input"]["state"]
+
+        futures = {
+            stage: _stage_executor.submit(
+                contextvars.copy_context().run, run_and_report, stage, fn, input, state, self.cache_keys.get(stage)
+            )
+            for stage, fn in self.fns.items()
+        }
+        exceptions = []
+        for stage, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                exceptions.append(f"{stage}: {e}")
+                state.setdefault("failed_stage", stage)
+
+        return {
+            "output": {
+                "error": bool(exceptions),
+                "exception": "; ".join(exceptions) if exceptions else None,
+                "input": input,
+                "state": state,
+            }
+        }
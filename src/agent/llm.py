@@ -0,0 +1,158 @@
+import contextvars
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+
+import requests
+from llama_index.core import Settings
+from llama_index.core.llms import CompletionResponse
+
+from agent.admission import get_llm_admission
+from agent.deadline import check, clip_timeout, remaining, wait
+from agent.llm_gateway import get_llm_gateway
+from agent.metrics import add_stage_time, registry
+from agent.prompt_budget import estimate_tokens, parse_stage_values
+from agent.schemas import OMIT_EXPLANATIONS, response_schema
+
+logger = logging.getLogger("goat_nlp.llm")
+
+# Send each stage's JSON schema to Ollama, which then only samples tokens that keep the output valid.
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "false").lower() == "true"
+# Completion token caps for structured output, e.g. "entity=384,attribute=512".
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 512))
+STAGE_MAX_TOKENS = parse_stage_values(
+    os.getenv(
+        "STAGE_MAX_TOKENS",
+        "index=128,intent=128,time=160,classification=192,rank=160,lineage=128,record=128,entity=384,attribute=512",
+    )
+)
+LLM_STOP = [stop for stop in os.getenv("LLM_STOP", "").split(",") if stop]
+# Longest a single completion may take, whatever the request deadline.
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 300))
+
+# Completions under a request deadline run here, so the caller can stop waiting when it passes. Calls waiting
+# for an admission slot hold a thread too, so this should exceed LLM_MAX_CONCURRENCY + LLM_MAX_QUEUE.
+_llm_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_CALL_THREADS", 64)),
+    thread_name_prefix="llm_call",
+)
+
+_EXPLANATION_FIELD = re.compile(r',\s*"explanation": "\.\.\."')
+
+
+def max_tokens(stage: str) -> int:
+    return STAGE_MAX_TOKENS.get(stage, LLM_MAX_TOKENS)
+
+
+def strip_explanation(prompt: str) -> str:
+    """Remove the `explanation` field from the JSON format a prompt asks for."""
+    return _EXPLANATION_FIELD.sub("", prompt)
+
+
+def _ollama_generate(stage: str, prompt: str) -> CompletionResponse:
+    options: Dict[str, Any] = {"num_predict": max_tokens(stage)}
+    if LLM_STOP:
+        options["stop"] = LLM_STOP
+    if getattr(Settings.llm, "temperature", None) is not None:
+        options["temperature"] = Settings.llm.temperature
+    base_url = os.getenv("OLLAMA_HOST_URL", "http://127.0.0.1:11434").rstrip("/")
+    response = requests.post(
+        f"{base_url}/api/generate",
+        json={
+            "model": os.getenv("OLLAMA_MODEL", "llama3"),
+            "prompt": prompt,
+            "format": response_schema(stage),
+            "options": options,
+            "stream": False,
+            "keep_alive": os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+        },
+        timeout=clip_timeout(LLM_REQUEST_TIMEOUT, f"{stage} completion"),
+    )
+    response.raise_for_status()
+    body = response.json()
+    return CompletionResponse(text=body["response"], raw=body)
+
+
+def generate(stage: str, prompt: str) -> CompletionResponse:
+    """A single completion from the configured backend, schema-constrained when `STRUCTURED_OUTPUT` is on."""
+    if STRUCTURED_OUTPUT:
+        return _ollama_generate(stage, prompt)
+    return Settings.llm.complete(prompt)
+
+
+def _token_counts(prompt: str, text: str, raw: Any) -> Tuple[int, int, bool]:
+    """Prompt and completion tokens as reported by the backend, or estimated when it reports none."""
+    try:
+        usage = raw.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", raw.get("prompt_eval_count"))
+        completion_tokens = usage.get("completion_tokens", raw.get("eval_count"))
+        if prompt_tokens is not None and completion_tokens is not None:
+            return int(prompt_tokens), int(completion_tokens), False
+    except (AttributeError, TypeError):
+        pass
+    return estimate_tokens(prompt), estimate_tokens(text), True
+
+
+def _admitted_generate(stage: str, prompt: str) -> Tuple[CompletionResponse, float]:
+    """
+    Generate while holding an LLM admission slot, through the gateway when batching is on.
+
+    The slot is held until the model server answers, even when the caller
+    stopped waiting, so it keeps counting against `LLM_MAX_CONCURRENCY`.
+
+    Returns:
+        tuple: The completion and the seconds it took once admitted.
+    """
+    with get_llm_admission().slot(stage):
+        start = time.perf_counter()
+        gateway = get_llm_gateway()
+        response = gateway.submit(stage, prompt).result() if gateway is not None else generate(stage, prompt)
+        return response, time.perf_counter() - start
+
+
+def complete(stage: str, prompt: str, state: Dict[str, Any]) -> str:
+    """
+    Run a completion for `stage` and record its token usage in `state["usage"][stage]`.
+
+    Args:
+        stage (str): Name of the pipeline stage making the call.
+        prompt (str): The formatted prompt. Its `explanation` field is dropped when `OMIT_EXPLANATIONS` is on.
+        state (dict): The pipeline state.
+
+    Returns:
+        str: The completion text.
+
+    Raises:
+        AdmissionRejected: If the LLM admission queue is full or the wait timed out.
+        DeadlineExceeded: If the request deadline passed first.
+    """
+    if OMIT_EXPLANATIONS:
+        prompt = strip_explanation(prompt)
+    check(f"{stage} completion")
+    if remaining() is None:
+        response, latency = _admitted_generate(stage, prompt)
+    else:
+        # An abandoned call keeps running until LLM_REQUEST_TIMEOUT, and keeps its slot, but the request moves on.
+        future = _llm_executor.submit(contextvars.copy_context().run, _admitted_generate, stage, prompt)
+        response, latency = wait(future, f"{stage} completion")
+    add_stage_time("llm", latency)
+    registry.observe("goat_nlp_llm_seconds", "Latency of a single LLM completion.", latency, stage=stage)
+    prompt_tokens, completion_tokens, estimated = _token_counts(prompt, response.text, response.raw)
+
+    usage = state.setdefault("usage", {}).setdefault(
+        stage, {"calls": 0, "prompt_chars": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated": False}
+    )
+    usage["calls"] += 1
+    usage["prompt_chars"] += len(prompt)
+    usage["prompt_tokens"] += prompt_tokens
+    usage["completion_tokens"] += completion_tokens
+    usage["estimated"] = usage["estimated"] or estimated
+
+    logger.info(
+        f"{stage}: {prompt_tokens} prompt tokens ({len(prompt)} chars), {completion_tokens} completion tokens"
+        + (" (estimated)" if estimated else "")
+    )
+    return response.text
@@ -0,0 +1,206 @@
+"""
+Micro-batching of LLM completions across concurrent requests and stages.
+
+With `LLM_BATCHING` set, `llm.complete` hands its prompt to the gateway instead
+of calling the backend directly. A dispatcher thread collects prompts for up
+to `LLM_BATCH_WINDOW_MS` after the first one arrives, or until
+`LLM_BATCH_MAX_SIZE` are waiting, and submits them together. Each caller
+blocks on its own future and gets back its own completion.
+
+Backends:
+
+- `parallel`: every prompt of a batch goes to `llm.generate` at the same time,
+  which fills the model server's parallel slots (e.g. `OLLAMA_NUM_PARALLEL`)
+- `openai`: one request with a list of prompts to an OpenAI-compatible
+  `/completions` endpoint that batches on the server (e.g. vLLM). A batch mixes
+  stages, so it is not schema-constrained; it gets the largest stage token cap
+  of the batch and `LLM_STOP`.
+"""
+
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, Union
+
+import requests
+from llama_index.core.llms import CompletionResponse
+
+from agent.metrics import registry
+
+logger = logging.getLogger("goat_nlp.llm_gateway")
+
+# (stage, prompt) pairs
+Batch = List[Tuple[str, str]]
+BatchResult = List[Union[CompletionResponse, Exception]]
+
+
+class ParallelBackend:
+    """
+    Submits the prompts of a batch to `llm.generate` concurrently.
+
+    Args:
+        max_workers (int): Completions run at once across all batches.
+    """
+
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm_parallel")
+
+    def __call__(self, batch: Batch) -> BatchResult:
+        from agent.llm import generate
+
+        futures = [self._executor.submit(generate, stage, prompt) for stage, prompt in batch]
+        results: BatchResult = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class OpenAIBatchBackend:
+    """
+    Sends the whole batch as one request to an OpenAI-compatible `/completions` endpoint.
+
+    Args:
+        base_url (str): API base URL, e.g. http://127.0.0.1:8000/v1
+        model (str): Model name.
+        max_tokens (int): Most completion tokens per prompt, whatever the stage caps.
+        timeout (float): Request timeout in seconds.
+        api_key (str, optional): Bearer token.
+    """
+
+    def __init__(self, base_url: str, model: str, max_tokens: int, timeout: float, api_key: Optional[str] = None):
+        self.url = base_url.rstrip("/") + "/completions"
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def __call__(self, batch: Batch) -> BatchResult:
+        from agent.llm import LLM_STOP, max_tokens
+
+        payload = {
+            "model": self.model,
+            "prompt": [prompt for _, prompt in batch],
+            "max_tokens": min(self.max_tokens, max(max_tokens(stage) for stage, _ in batch)),
+            "temperature": 0,
+        }
+        if LLM_STOP:
+            payload["stop"] = LLM_STOP
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        choices = sorted(body["choices"], key=lambda choice: choice["index"])
+        # Usage is reported for the whole batch, so per-prompt token counts are left to be estimated.
+        return [CompletionResponse(text=choice["text"]) for choice in choices]
+
+
+class LLMGateway:
+    """
+    Collects prompts into batches and hands each completion back to its caller.
+
+    Args:
+        backend (callable): Takes a list of (stage, prompt) pairs and returns a completion or exception per prompt.
+        max_batch_size (int): Most prompts submitted together.
+        max_wait (float): Seconds to wait for more prompts after the first one of a batch.
+        max_in_flight (int): Batches submitted at once.
+    """
+
+    def __init__(
+        self,
+        backend: Callable[[Batch], BatchResult],
+        max_batch_size: int = 4,
+        max_wait: float = 0.01,
+        max_in_flight: int = 2,
+    ):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Tuple[str, str, Future]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="llm_batch")
+        threading.Thread(target=self._dispatch, name="llm_gateway", daemon=True).start()
+
+    @classmethod
+    def from_env(cls, mode: str) -> "LLMGateway":
+        """
+        The gateway configured by the `LLM_BATCH_*` variables.
+
+        Raises:
+            ValueError: If `mode` is unknown, or `LLM_BATCH_MAX_SIZE` exceeds `LLM_MAX_CONCURRENCY`: every
+                caller holds an admission slot while its prompt waits for the batch, so such batches never fill.
+        """
+        from agent.admission import get_llm_admission
+
+        max_batch_size = int(os.getenv("LLM_BATCH_MAX_SIZE", 4))
+        max_concurrency = get_llm_admission().max_concurrency
+        if 0 < max_concurrency < max_batch_size:
+            raise ValueError(
+                f"LLM_BATCH_MAX_SIZE ({max_batch_size}) must not exceed LLM_MAX_CONCURRENCY ({max_concurrency})"
+            )
+        max_in_flight = int(os.getenv("LLM_BATCH_MAX_IN_FLIGHT", 2))
+        if mode == "openai":
+            backend = OpenAIBatchBackend(
+                os.getenv("LLM_BATCH_BASE_URL", "http://127.0.0.1:8000/v1"),
+                # An empty value (e.g. from a copied .env.dist) means unset.
+                os.getenv("LLM_BATCH_MODEL") or os.getenv("OLLAMA_MODEL", "llama3"),
+                max_tokens=int(os.getenv("LLM_BATCH_MAX_TOKENS", 512)),
+                timeout=float(os.getenv("LLM_BATCH_TIMEOUT", 600)),
+                api_key=os.getenv("LLM_BATCH_API_KEY"),
+            )
+        elif mode == "parallel":
+            backend = ParallelBackend(max_batch_size * max_in_flight)
+        else:
+            raise ValueError(f"LLM_BATCHING must be off, parallel or openai, not {mode!r}")
+        return cls(backend, max_batch_size, float(os.getenv("LLM_BATCH_WINDOW_MS", 10)) / 1000, max_in_flight)
+
+    def submit(self, stage: str, prompt: str) -> Future:
+        """Queue `stage`'s `prompt` for the next batch; the future resolves to its completion."""
+        future: Future = Future()
+        self._queue.put((stage, prompt, future))
+        return future
+
+    def _dispatch(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            registry.observe("goat_nlp_llm_batch_size", "Prompts per LLM batch.", len(batch))
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Tuple[str, str, Future]]):
+        try:
+            results = self.backend([(stage, prompt) for stage, prompt, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Backend returned {len(results)} completions for {len(batch)} prompts")
+        except Exception as e:
+            logger.exception(f"LLM batch of {len(batch)} failed")
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+@functools.lru_cache(maxsize=None)
+def get_llm_gateway() -> Optional[LLMGateway]:
+    """The gateway for `LLM_BATCHING`, or None when completions go straight to the backend."""
+    mode = os.getenv("LLM_BATCHING", "off").lower()
+    if mode == "off":
+        return None
+    logger.info(f"Batching LLM completions with the {mode} backend")
+    return LLMGateway.from_env(mode)
@@ -0,0 +1,232 @@
+"""
+Per-stage timings and process-wide latency summaries.
+
+Every pipeline stage runs through `run_stage`, which records its wall time and
+the time it spent waiting on the LLM and the GoaT API in
+`state["metrics"][stage]`. When a translation attempt finishes, `translator`
+calls `record_translation`, which feeds those timings and the stage's token
+usage into sliding-window summaries labelled by stage, index and intent.
+`render_metrics` formats them, plus the GoaT client and fast-path classifier
+counters, in the Prometheus text exposition format.
+"""
+
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# Number of most recent observations each quantile is computed over.
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", 1024))
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Time spent in the LLM and the GoaT API by the stage running in this context.
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "stage_timings", default=None
+)
+
+
+class Summary:
+    """Count and sum of every observation, plus quantiles over the last `window` ones."""
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self) -> Dict[float, float]:
+        values = sorted(self.recent)
+        if not values:
+            return {quantile: math.nan for quantile in QUANTILES}
+        return {quantile: values[min(int(quantile * len(values)), len(values) - 1)] for quantile in QUANTILES}
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of labelled summaries and counters.
+
+    Args:
+        window (int): Observations kept per summary for quantiles.
+    """
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._help: Dict[str, str] = {}
+        self._summaries: Dict[str, Dict[Labels, Summary]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+
+    def observe(self, name: str, help: str, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._summaries.setdefault(name, {})
+            if key not in series:
+                series[key] = Summary(self.window)
+            series[key].observe(value)
+
+    def increment(self, name: str, help: str, value: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._summaries.items()):
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} summary"]
+                for labels, summary in sorted(series.items()):
+                    for quantile, value in summary.quantiles().items():
+                        lines.append(f"{name}{_format_labels(labels + (('quantile', str(quantile)),))} {value}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {summary.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {summary.count}")
+            for name, series in sorted(self._counters.items()):
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in sorted(series.items())]
+        return lines
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+registry = MetricsRegistry()
+
+
+def add_stage_time(kind: str, seconds: float):
+    """Attribute `seconds` of `kind` (`llm` or `goat`) to the stage running in the current context, if any."""
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[kind] = timings.get(kind, 0.0) + seconds
+
+
+def run_stage(stage: str, fn: Callable[[str, Dict[str, Any]], Any], input: str, state: Dict[str, Any]):
+    """
+    Run a stage function and record its timings in `state["metrics"][stage]`.
+
+    Exceptions are counted and re-raised.
+    """
+    timings: Dict[str, float] = {}
+    token = _stage_timings.set(timings)
+    start = time.perf_counter()
+    error = False
+    try:
+        return fn(input, state)
+    except Exception:
+        error = True
+        raise
+    finally:
+        wall = time.perf_counter() - start
+        _stage_timings.reset(token)
+        stage_metrics = state.setdefault("metrics", {}).setdefault(
+            stage, {"calls": 0, "errors": 0, "wall_seconds": 0.0, "llm_seconds": 0.0, "goat_seconds": 0.0}
+        )
+        stage_metrics["calls"] += 1
+        stage_metrics["errors"] += error
+        stage_metrics["wall_seconds"] += wall
+        stage_metrics["llm_seconds"] += timings.get("llm", 0.0)
+        stage_metrics["goat_seconds"] += timings.get("goat", 0.0)
+
+
+def record_translation(state: Dict[str, Any], seconds: float, outcome: str):
+    """
+    Feed one translation attempt into the process-wide summaries.
+
+    Args:
+        state (dict): The pipeline state after the attempt.
+        seconds (float): Wall time of the attempt.
+        outcome (str): `ok`, `follow_up`, `error`, `rejected`, `timeout`, `cached` or `matched`.
+    """
+    index = (state.get("index") or {}).get("classification") or "unknown"
+    intent = (state.get("intent") or {}).get("intent") or "unknown"
+
+    registry.observe(
+        "goat_nlp_translation_seconds",
+        "Wall time of a translation attempt.",
+        seconds,
+        index=index,
+        intent=intent,
+        outcome=outcome,
+    )
+    if outcome in ("cached", "matched"):
+        # No stage ran; a cached state still carries the timings of the run that produced it.
+        return
+
+    for stage, stage_metrics in state.get("metrics", {}).items():
+        labels = {"stage": stage, "index": index, "intent": intent}
+        registry.observe(
+            "goat_nlp_stage_seconds", "Wall time of a pipeline stage.", stage_metrics["wall_seconds"], **labels
+        )
+        registry.observe(
+            "goat_nlp_stage_llm_seconds",
+            "Time a stage spent waiting on the LLM.",
+            stage_metrics["llm_seconds"],
+            **labels,
+        )
+        registry.observe(
+            "goat_nlp_stage_goat_seconds",
+            "Time a stage spent waiting on the GoaT API.",
+            stage_metrics["goat_seconds"],
+            **labels,
+        )
+        registry.increment("goat_nlp_stage_runs_total", "Stage executions.", stage_metrics["calls"], stage=stage)
+        registry.increment(
+            "goat_nlp_stage_errors_total", "Failed stage executions.", stage_metrics["errors"], stage=stage
+        )
+    for stage, retries in state.get("retries", {}).items():
+        registry.increment("goat_nlp_stage_retries_total", "Retries of failed stages.", retries, stage=stage)
+    for stage, usage in state.get("usage", {}).items():
+        labels = {"stage": stage, "index": index, "intent": intent}
+        registry.observe("goat_nlp_stage_prompt_tokens", "Prompt tokens per stage.", usage["prompt_tokens"], **labels)
+        registry.observe(
+            "goat_nlp_stage_completion_tokens", "Completion tokens per stage.", usage["completion_tokens"], **labels
+        )
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    from agent.admission import get_llm_admission
+    from agent.fast_classifier import get_fast_classifier
+    from agent.goat_client import get_goat_client
+
+    lines = registry.render()
+
+    for gauge, value in get_llm_admission().stats().items():
+        name = f"goat_nlp_llm_{gauge}"
+        lines += [f"# HELP {name} LLM completions {gauge} right now.", f"# TYPE {name} gauge", f"{name} {value}"]
+
+    goat_stats = get_goat_client().stats()
+    for counter in ("requests", "bytes", "retries", "errors", "coalesced"):
+        name = f"goat_nlp_goat_api_{counter}_total"
+        lines += [f"# HELP {name} GoaT API {counter} per endpoint.", f"# TYPE {name} counter"]
+        lines += [
+            f"{name}{_format_labels((('endpoint', endpoint),))} {counters[counter]}"
+            for endpoint, counters in sorted(goat_stats.items())
+        ]
+
+    classifier = get_fast_classifier()
+    if classifier is not None:
+        classifier_stats = classifier.stats()
+        for counter in ("hits", "fallbacks"):
+            name = f"goat_nlp_fast_classifier_{counter}_total"
+            lines += [f"# HELP {name} Fast-path classifier {counter} per task.", f"# TYPE {name} counter"]
+            lines += [
+                f"{name}{_format_labels((('task', task),))} {counts[counter]}"
+                for task, counts in sorted(classifier_stats.items())
+            ]
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,95 @@
+"""
+Stage-by-stage progress events for streaming translations.
+
+Components call `report_stage` after every stage. While a listener is installed
+with `stage_listener`, it receives that stage's part of the state as soon as the
+stage finishes; the listener lives in a context variable, so it follows the
+request into the parallel stage threads and concurrent requests do not see each
+other's events.
+"""
+
+import contextlib
+import contextvars
+import copy
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from agent.component_helpers import STAGE_OUTPUTS
+from agent.deadline import REQUEST_DEADLINE, Deadline, use_deadline
+
+logger = logging.getLogger("goat_nlp.progress")
+
+Listener = Callable[[Dict[str, Any]], None]
+
+_listener: contextvars.ContextVar[Optional[Listener]] = contextvars.ContextVar("stage_listener", default=None)
+
+
+@contextlib.contextmanager
+def stage_listener(listener: Listener):
+    """Send every stage event raised in this context to `listener`."""
+    token = _listener.set(listener)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+def report_stage(stage: str, state: Dict[str, Any], exception: Optional[str] = None):
+    """Send `stage`'s outputs to the current listener, if any. Listener failures never fail the stage."""
+    listener = _listener.get()
+    if listener is None:
+        return
+    event = {
+        "event": "stage",
+        "stage": stage,
+        "result": {key: copy.deepcopy(state[key]) for key in STAGE_OUTPUTS.get(stage, ()) if key in state},
+        "error": exception,
+    }
+    try:
+        listener(event)
+        if exception is None and "final_url" in event["result"]:
+            # The URL is known before the pipeline (and the translator) has finished.
+            listener({"event": "url", "url": str(event["result"]["final_url"])})
+    except Exception:
+        logger.exception(f"Progress listener failed for stage {stage}")
+
+
+def translate_stream(query: str, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Translate `query`, yielding stage events as they happen and finally a `done` or `error` event.
+
+    The translation runs under `REQUEST_DEADLINE`, and is cancelled when the
+    consumer stops reading (e.g. the client disconnects). `session_id` is passed
+    on to `translate`, so follow-ups only re-run the stages they change.
+
+    Events:
+        - `{"event": "stage", "stage": ..., "result": {...}, "error": ...}` after every stage
+        - `{"event": "url", "url": ...}` as soon as a URL is known
+        - `{"event": "done", "url": ..., "degraded": [...]}` or `{"event": "error", "error": ...}` at the end
+    """
+    from agent.translator import translate
+
+    events: queue.Queue = queue.Queue()
+    deadline = Deadline(REQUEST_DEADLINE)
+
+    def run():
+        with use_deadline(deadline), stage_listener(events.put):
+            try:
+                state = translate(query, session_id)
+                events.put({"event": "done", "url": state["final_url"], "degraded": state.get("degraded", [])})
+            except Exception as e:
+                logger.warning(f"Streaming translation failed: {query!r}")
+                events.put({"event": "error", "error": str(e.__cause__ or e)})
+
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), name="goat_stream", daemon=True).start()
+    try:
+        while True:
+            event = events.get()
+            yield event
+            if event["event"] in ("done", "error"):
+                return
+    finally:
+        # Stops the remaining stages at their next LLM or GoaT call if the consumer went away.
+        deadline.cancel()
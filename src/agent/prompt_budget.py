@@ -0,0 +1,65 @@
+import json
+import math
+import os
+from typing import Any, Dict, Optional
+
+COMPACT_PROMPTS = os.getenv("COMPACT_PROMPTS", "false").lower() == "true"
+# Items kept in nested lists (e.g. each candidate's lineage) in compact mode.
+PROMPT_MAX_NESTED_ITEMS = int(os.getenv("PROMPT_MAX_NESTED_ITEMS", 10))
+
+
+def parse_stage_values(value: str) -> Dict[str, int]:
+    """Parse per-stage integers written as "stage=value,stage=value"."""
+    budgets = {}
+    for item in value.split(","):
+        if "=" in item:
+            stage, budget = item.split("=", 1)
+            budgets[stage.strip()] = int(budget)
+    return budgets
+
+
+# Approximate token budget for the JSON embedded in each stage's prompt, e.g. "rank=1500,lineage=400"
+STAGE_TOKEN_BUDGETS = parse_stage_values(os.getenv("STAGE_TOKEN_BUDGETS", "rank=2000,record=2000,lineage=800"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return math.ceil(len(text) / 4)
+
+
+def _drop_nulls(value: Any, depth: int = 0) -> Any:
+    if isinstance(value, dict):
+        return {key: _drop_nulls(item, depth + 1) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        items = value if depth == 0 else value[:PROMPT_MAX_NESTED_ITEMS]
+        return [_drop_nulls(item, depth + 1) for item in items]
+    return value
+
+
+def to_prompt_json(value: Any, stage: str, compact: Optional[bool] = None) -> str:
+    """
+    Serialize `value` for embedding in a stage's prompt.
+
+    By default this is the indented JSON the prompts have always used. In compact
+    mode (`COMPACT_PROMPTS=true`, or `compact=True`) indentation and null fields are
+    dropped, nested lists are capped at `PROMPT_MAX_NESTED_ITEMS`, and a top-level
+    list is truncated to fit the stage's entry in `STAGE_TOKEN_BUDGETS`.
+    """
+    if not (COMPACT_PROMPTS if compact is None else compact):
+        return json.dumps(value, indent=4)
+
+    value = _drop_nulls(value)
+    text = json.dumps(value, separators=(",", ":"))
+    budget = STAGE_TOKEN_BUDGETS.get(stage)
+    if budget is None or not isinstance(value, list) or estimate_tokens(text) <= budget:
+        return text
+
+    # Longest prefix that fits; the API and lineage orders put the most relevant entries first.
+    low, high = 1, len(value)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(json.dumps(value[:middle], separators=(",", ":"))) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return json.dumps(value[:low], separators=(",", ":"))
@@ -0,0 +1,191 @@
+"""
+Nearest-neighbour index over known `english_query` -> `api_query` translations.
+
+The index directory holds:
+
+- `embeddings.f32`: raw float32 matrix, one unit-length embedding per row
+- `translations.jsonl`: the matching `{"english_query", "api_query"}` rows
+- `meta.json`: the embedding dimension and model name
+
+The matrix is opened with `numpy.memmap`, and new verified translations are
+appended to both files without rebuilding the index.
+
+Usage:
+    python -m agent.query_index build --data queries/script_generated_queries.json --out query_index
+    python -m agent.query_index add --index query_index --english "..." --api "https://goat.genomehubs.org/..."
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from agent.embeddings import EMBED_MODEL, embed_texts
+from agent.entity_detector import get_entity_lexicon
+
+logger = logging.getLogger("goat_nlp.query_index")
+
+QUERY_INDEX_THRESHOLD = float(os.getenv("QUERY_INDEX_THRESHOLD", 0.97))
+
+
+class QueryIndex:
+    """
+    Memory-mapped embedding index of known translations.
+
+    Args:
+        path (str): Directory containing the index files.
+
+    Raises:
+        ValueError: If the index was built with another embedding model or dimension than `EMBED_MODEL`'s.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        self.dimension = meta["dimension"]
+        if meta["model"] != EMBED_MODEL:
+            raise ValueError(f"Query index at {path} was built with {meta['model']}, not {EMBED_MODEL}; rebuild it")
+        dimension = embed_texts([""]).shape[1]
+        if self.dimension != dimension:
+            raise ValueError(f"Query index at {path} has dimension {self.dimension}, not {dimension}; rebuild it")
+        self._lock = threading.Lock()
+        with self._lock:
+            self._load()
+
+    def _embeddings_size(self) -> int:
+        return os.path.getsize(os.path.join(self.path, "embeddings.f32"))
+
+    def _load(self):
+        """Reload both files; the caller holds the lock."""
+        self._loaded_size = self._embeddings_size()
+        with open(os.path.join(self.path, "translations.jsonl")) as translations_file:
+            translations = [json.loads(line) for line in translations_file if line.strip()]
+        # Another process may have appended an embedding but not yet its translation.
+        rows = min(self._loaded_size // (4 * self.dimension), len(translations))
+        embeddings = (
+            np.memmap(
+                os.path.join(self.path, "embeddings.f32"), dtype=np.float32, mode="r", shape=(rows, self.dimension)
+            )
+            if rows
+            else np.zeros((0, self.dimension), dtype=np.float32)
+        )
+        # Replaced together, so readers always see matching rows.
+        self._snapshot = (embeddings, translations[:rows])
+
+    @property
+    def translations(self) -> List[Dict[str, str]]:
+        return self._snapshot[1]
+
+    @classmethod
+    def build(cls, translations: List[Dict[str, str]], path: str) -> "QueryIndex":
+        """Embed `translations` and write a new index to `path`."""
+        os.makedirs(path, exist_ok=True)
+        embeddings = embed_texts([translation["english_query"] for translation in translations])
+        embeddings.astype(np.float32).tofile(os.path.join(path, "embeddings.f32"))
+        with open(os.path.join(path, "translations.jsonl"), "w") as translations_file:
+            for translation in translations:
+                translations_file.write(
+                    json.dumps({"english_query": translation["english_query"], "api_query": translation["api_query"]})
+                    + "\n"
+                )
+        with open(os.path.join(path, "meta.json"), "w") as meta_file:
+            json.dump({"dimension": int(embeddings.shape[1]), "model": EMBED_MODEL}, meta_file)
+        logger.info(f"Built query index with {len(translations)} translations in {path}")
+        return cls(path)
+
+    def add(self, english_query: str, api_query: str):
+        """Append a verified translation to the index."""
+        embedding = embed_texts([english_query]).astype(np.float32)
+        with self._lock:
+            with open(os.path.join(self.path, "embeddings.f32"), "ab") as embeddings_file:
+                embedding.tofile(embeddings_file)
+            with open(os.path.join(self.path, "translations.jsonl"), "a") as translations_file:
+                translations_file.write(json.dumps({"english_query": english_query, "api_query": api_query}) + "\n")
+            self._load()
+
+    def nearest(self, query: str) -> Optional[Dict[str, Any]]:
+        """The closest known translation with its cosine similarity and distance, or None if the index is empty."""
+        with self._lock:
+            if self._embeddings_size() != self._loaded_size:
+                # Another process added translations.
+                self._load()
+            embeddings, translations = self._snapshot
+        if not len(embeddings):
+            return None
+        # Embedded like the stored queries, without the retrieval instruction `embed_query` adds, so that
+        # a repeated query scores 1.
+        similarities = embeddings @ embed_texts([query])[0]
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        return {**translations[best], "similarity": similarity, "distance": 1 - similarity}
+
+
+@functools.lru_cache(maxsize=None)
+def get_query_index() -> Optional[QueryIndex]:
+    """The index at `QUERY_INDEX_PATH`, or None when the short-circuit is disabled."""
+    path = os.getenv("QUERY_INDEX_PATH")
+    if not path:
+        return None
+    try:
+        index = QueryIndex(path)
+    except (OSError, ValueError, KeyError):
+        logger.exception(f"Could not open query index at {path}, always running the pipeline")
+        return None
+    logger.info(f"Opened query index at {path} with {len(index.translations)} translations")
+    return index
+
+
+def match_known_translation(query: str) -> Optional[Dict[str, Any]]:
+    """
+    The nearest known translation, flagged with whether it can short-circuit the pipeline.
+
+    It can when it is close enough and names the same organisms: template
+    questions that differ only in the taxon are otherwise nearly identical.
+
+    Returns None when no index is configured or embedding fails.
+    """
+    index = get_query_index()
+    if index is None:
+        return None
+    try:
+        match = index.nearest(query)
+    except Exception:
+        logger.exception("Query index lookup failed")
+        return None
+    if match is not None:
+        match["accepted"] = match["similarity"] >= QUERY_INDEX_THRESHOLD and _taxa(query) == _taxa(
+            match["english_query"]
+        )
+    return match
+
+
+def _taxa(text: str) -> frozenset:
+    """The organisms a query names: the lexicon's scientific names plus the words it could not resolve."""
+    entities, unmatched = get_entity_lexicon().match(text)
+    return frozenset(entity["scientific_name"] for entity in entities) | {word.casefold() for word in unmatched}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build or extend the known-translation index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build the index from a query dataset")
+    build_parser.add_argument("--data", default="queries/script_generated_queries.json", help="Query dataset")
+    build_parser.add_argument("--out", required=True, help="Output directory")
+    add_parser = subparsers.add_parser("add", help="Add a verified translation")
+    add_parser.add_argument("--index", required=True, help="Index directory")
+    add_parser.add_argument("--english", required=True, help="Natural language query")
+    add_parser.add_argument("--api", required=True, help="Verified GoaT URL")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with open(args.data) as data_file:
+            QueryIndex.build(json.load(data_file), args.out)
+    else:
+        QueryIndex(args.index).add(args.english, args.api)
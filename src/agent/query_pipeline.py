@@ -1,44 +1,114 @@
+import os
+
 from llama_index.core.query_pipeline import QueryPipeline as QP
 
 from agent.component_helpers import (
+    attribute_cache_key,
     construct_query,
     construct_url,
     identify_attributes,
+    identify_classification,
     identify_entity,
     identify_index,
     identify_intent,
     identify_rank,
     identify_record,
     identify_time_frame,
+    rank_cache_key,
+    record_cache_key,
 )
-from agent.goat_query_component import GoatQueryComponent
-
-qp = QP(verbose=True)
-
-qp.add_modules(
-    {
-        "index": GoatQueryComponent(fn=identify_index),
-        "entity": GoatQueryComponent(fn=identify_entity),
-        "rank": GoatQueryComponent(fn=identify_rank),
-        "intent": GoatQueryComponent(fn=identify_intent),
-        "attribute": GoatQueryComponent(fn=identify_attributes),
-        "time": GoatQueryComponent(fn=identify_time_frame),
-        "query": GoatQueryComponent(fn=construct_query),
-        "url": GoatQueryComponent(fn=construct_url),
-        "record": GoatQueryComponent(fn=identify_record),
-    }
-)
+from agent.goat_query_component import GoatParallelComponent, GoatQueryComponent
 
 
-qp.add_chain(["intent", "index", "entity"])
+def is_record_intent(x) -> bool:
+    return x["state"].get("intent", {}).get("intent") == "record"
 
-qp.add_link(
-    "entity",
-    "record",
-    condition_fn=lambda x: x["state"]["intent"]["intent"] == "record",
-)
-qp.add_link(
-    "entity", "rank", condition_fn=lambda x: x["state"]["intent"]["intent"] != "record"
+
+def build_sequential_pipeline(fused: bool = False) -> QP:
+    """
+    Run every stage one after the other.
+
+    With `fused`, intent, index and time frame come from a single completion
+    (`identify_classification`) instead of three separate stages.
+    """
+    pipeline = QP(verbose=True)
+
+    pipeline.add_modules(
+        {
+            "entity": GoatQueryComponent(stage="entity", fn=identify_entity),
+            "rank": GoatQueryComponent(stage="rank", fn=identify_rank, cache_key=rank_cache_key),
+            "attribute": GoatQueryComponent(stage="attribute", fn=identify_attributes, cache_key=attribute_cache_key),
+            "query": GoatQueryComponent(stage="query", fn=construct_query),
+            "url": GoatQueryComponent(stage="url", fn=construct_url),
+            "record": GoatQueryComponent(stage="record", fn=identify_record, cache_key=record_cache_key),
+        }
+    )
+    if fused:
+        pipeline.add_modules(
+            {"classification": GoatQueryComponent(stage="classification", fn=identify_classification)}
+        )
+        pipeline.add_chain(["classification", "entity"])
+    else:
+        pipeline.add_modules(
+            {
+                "index": GoatQueryComponent(stage="index", fn=identify_index),
+                "intent": GoatQueryComponent(stage="intent", fn=identify_intent),
+                "time": GoatQueryComponent(stage="time", fn=identify_time_frame),
+            }
+        )
+        pipeline.add_chain(["intent", "index", "entity"])
+
+    pipeline.add_link("entity", "record", condition_fn=is_record_intent)
+    pipeline.add_link("entity", "rank", condition_fn=lambda x: not is_record_intent(x))
+    pipeline.add_chain(["rank", "attribute"] + ([] if fused else ["time"]) + ["query", "url"])
+    return pipeline
+
+
+def build_parallel_pipeline(fused: bool = False) -> QP:
+    """
+    Same stages as the sequential pipeline, grouped by what they actually read.
+
+    - intent, index, entity, time: only the raw input
+    - rank: index + entity, attribute: index
+    - record: index + entity
+    - query: rank + attribute + time + index, url: query + intent + index
+    """
+    pipeline = QP(verbose=True)
+
+    classify_fns = (
+        {"classification": identify_classification, "entity": identify_entity}
+        if fused
+        else {
+            "intent": identify_intent,
+            "index": identify_index,
+            "entity": identify_entity,
+            "time": identify_time_frame,
+        }
+    )
+    pipeline.add_modules(
+        {
+            "classify": GoatParallelComponent(fns=classify_fns),
+            "refine": GoatParallelComponent(
+                fns={"rank": identify_rank, "attribute": identify_attributes},
+                cache_keys={"rank": rank_cache_key, "attribute": attribute_cache_key},
+            ),
+            "query": GoatQueryComponent(stage="query", fn=construct_query),
+            "url": GoatQueryComponent(stage="url", fn=construct_url),
+            "record": GoatQueryComponent(stage="record", fn=identify_record, cache_key=record_cache_key),
+        }
+    )
+
+    pipeline.add_link("classify", "record", condition_fn=is_record_intent)
+    pipeline.add_link("classify", "refine", condition_fn=lambda x: not is_record_intent(x))
+    pipeline.add_chain(["refine", "query", "url"])
+    return pipeline
+
+
+PIPELINE_BUILDERS = {
+    "sequential": build_sequential_pipeline,
+    "parallel": build_parallel_pipeline,
+}
+
+qp = PIPELINE_BUILDERS[os.getenv("PIPELINE_MODE", "sequential")](
+    fused=os.getenv("FUSED_CLASSIFICATION", "false").lower() == "true"
 )
-qp.add_chain(["rank", "attribute", "time", "query", "url"])
-# qp.add_chain(["intent", "index", "entity", "rank", "time", "query", "url"])
@@ -0,0 +1,206 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+from llama_index.core import PromptTemplate, Settings
+
+import prompt
+from agent.sqlite_store import SQLiteStore
+
+logger = logging.getLogger("goat_nlp.response_cache")
+
+_OPERATOR = re.compile(r"([<>!]=?|=)")
+# Relative dates, and years, whose translation is resolved against the current date.
+_TIME_DEPENDENT = re.compile(
+    r"\b(?:\d{4}|year|month|week|day|decade|recent|recently|latest|last|past|since|ago|today|yesterday|"
+    r"current|currently|now|this|until|before|after)\b"
+)
+
+# Words that end in "s" but are already singular (or invariant) in our queries.
+_SINGULAR_EXCEPTIONS = {"species", "series", "genus", "status", "virus", "this", "has", "was", "is", "as", "us"}
+_IRREGULAR = {
+    "mice": "mouse",
+    "lice": "louse",
+    "geese": "goose",
+    "teeth": "tooth",
+    "feet": "foot",
+    "oxen": "ox",
+    "people": "person",
+    "children": "child",
+    "fungi": "fungus",
+    "cacti": "cactus",
+    "larvae": "larva",
+    "algae": "alga",
+}
+
+
+def singularize(word: str) -> str:
+    """Rough English singular of a lowercase word; it only has to map queries (and names) alike."""
+    if word in _IRREGULAR:
+        return _IRREGULAR[word]
+    if word in _SINGULAR_EXCEPTIONS or len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("ves"):
+        return word[:-3] + "f"
+    if word.endswith(("ches", "shes", "sses", "uses", "xes", "zes", "oes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a user query so that trivially different phrasings share a cache key.
+
+    Case, punctuation, repeated whitespace and singular/plural forms are folded.
+    The `*` wildcard, comparison operators and decimal points are kept since
+    they change the translation.
+    """
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = _OPERATOR.sub(r" \1 ", query)
+    query = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", query)
+    query = re.sub(r"[^\w\s*<>=!.]", " ", query)
+    return " ".join(singularize(token) for token in query.split())
+
+
+def cache_key(query: str) -> str:
+    """
+    The response cache key of `query`: its normalized text, plus today's date
+    when the translation depends on it (e.g. "last year", "since 2020").
+    """
+    key = normalize_query(query)
+    if _TIME_DEPENDENT.search(key):
+        key += f" @{datetime.date.today().isoformat()}"
+    return key
+
+
+def _prompt_hash() -> str:
+    templates = sorted(
+        (name, value.template) for name, value in vars(prompt).items() if isinstance(value, PromptTemplate)
+    )
+    return hashlib.sha256(json.dumps(templates).encode()).hexdigest()
+
+
+_PROMPT_HASH = _prompt_hash()
+
+
+# Settings that change the answer to a query, beyond the prompts and the model.
+ANSWER_SETTINGS = (
+    "COMPACT_PROMPTS",
+    "OMIT_EXPLANATIONS",
+    "STRUCTURED_OUTPUT",
+    "FUSED_CLASSIFICATION",
+    "PROMPT_MAX_NESTED_ITEMS",
+    "STAGE_TOKEN_BUDGETS",
+    "LLM_MAX_TOKENS",
+    "LLM_STOP",
+    "ATTRIBUTE_TOP_K",
+    "ATTRIBUTE_MIN_SIMILARITY",
+    "EMBED_MODEL",
+    "FAST_CLASSIFIER_PATH",
+    "FAST_CLASSIFIER_THRESHOLD",
+    "FAST_CLASSIFIER_MIN_COVERAGE",
+    "ENTITY_DETECTOR",
+    "ENTITY_LEXICON_PATH",
+    "ENTITY_SEARCH_SIZE",
+    "ENTITY_SEARCH_FIELDS",
+    "TAXONOMY_PATH",
+    "GOAT_BASE_URL",
+)
+
+
+def pipeline_fingerprint() -> str:
+    """Fingerprint of everything that changes a cached answer: the prompts, the model and `ANSWER_SETTINGS`."""
+    llm = Settings.llm
+    model = getattr(llm, "model", None) or llm.metadata.model_name
+    settings = json.dumps({name: os.getenv(name) for name in ANSWER_SETTINGS}, sort_keys=True)
+    return hashlib.sha256(f"{_PROMPT_HASH}:{type(llm).__name__}:{model}:{settings}".encode()).hexdigest()[:16]
+
+
+class ResponseCache(SQLiteStore):
+    """
+    SQLite-backed cache of pipeline results keyed on the normalized query text.
+
+    The database file is shared by every worker process on the host. Entries
+    expire after `ttl` seconds, the least recently used entries are evicted
+    beyond `max_entries`, and entries written under a different prompt/model
+    fingerprint are never returned.
+    """
+
+    def __init__(self, path: str, ttl: int, max_entries: int):
+        super().__init__(path, ttl, max_entries)
+        with self._connection() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    final_url TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        path = os.getenv("RESPONSE_CACHE_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            ttl=int(os.getenv("RESPONSE_CACHE_TTL", 7 * 24 * 60 * 60)),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 10000)),
+        )
+
+    def get(self, query: str) -> Optional[Dict[str, Any]]:
+        key = cache_key(query)
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT final_url, state FROM responses WHERE key = ? AND fingerprint = ? AND created_at >= ?",
+                (key, pipeline_fingerprint(), now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            logger.exception("Response cache lookup failed")
+            return None
+
+        logger.info(f"Response cache hit for {key!r}")
+        return {"final_url": row[0], "state": json.loads(row[1])}
+
+    def put(self, query: str, state: Dict[str, Any]):
+        key = cache_key(query)
+        now = time.time()
+        fingerprint = pipeline_fingerprint()
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, fingerprint, query, state["final_url"], json.dumps(state, default=str), now, now),
+            )
+            self._evict(connection, fingerprint, now)
+        except sqlite3.Error:
+            logger.exception("Response cache write failed")
+
+    def _evict(self, connection: sqlite3.Connection, fingerprint: str, now: float):
+        connection.execute(
+            "DELETE FROM responses WHERE fingerprint != ? OR created_at < ?", (fingerprint, now - self.ttl)
+        )
+        self._evict_least_recent(connection, "responses")
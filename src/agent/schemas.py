@@ -0,0 +1,126 @@
+"""
+Response schemas for every LLM stage.
+
+The schemas are sent to the backend for JSON-constrained decoding when
+`STRUCTURED_OUTPUT` is on, and every response is validated against them by
+`parse_response`, whichever backend produced it. With `OMIT_EXPLANATIONS` the
+`explanation` field is dropped from the schemas (and from the prompts, see
+`agent.llm`), so the model does not spend tokens on it.
+"""
+
+import copy
+import json
+import os
+from typing import Any, Dict
+
+from llama_index.core.output_parsers.utils import extract_json_str
+
+INDICES = ("taxon", "assembly", "sample")
+INTENTS = ("search", "count", "record")
+
+OMIT_EXPLANATIONS = os.getenv("OMIT_EXPLANATIONS", "false").lower() == "true"
+
+_STRING = {"type": "string"}
+_TAXON_ID = {"type": ["string", "integer"]}
+
+
+def _object(optional: tuple = (), **properties: Dict[str, Any]) -> Dict[str, Any]:
+    """An object schema with every property required, except those named in `optional`."""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": [name for name in properties if name not in optional],
+    }
+
+
+STAGE_SCHEMAS = {
+    "index": _object(classification={"type": "string", "enum": list(INDICES)}),
+    "intent": _object(intent={"type": "string", "enum": list(INTENTS)}),
+    "time": _object(from_date=_STRING, to_date=_STRING),
+    "classification": _object(
+        intent={"type": "string", "enum": list(INTENTS)},
+        classification={"type": "string", "enum": list(INDICES)},
+        from_date=_STRING,
+        to_date=_STRING,
+    ),
+    "entity": _object(
+        entities={
+            "type": "array",
+            "items": _object(singular_form=_STRING, plural_form=_STRING, scientific_name=_STRING),
+        }
+    ),
+    # The answer may leave out `taxon_id`, e.g. when the query names no taxon.
+    "rank": _object(optional=("taxon_id",), rank=_STRING, taxon_id={"type": ["string", "integer", "null"]}),
+    "lineage": _object(taxon_id=_TAXON_ID),
+    "record": _object(taxon_id=_TAXON_ID),
+    "attribute": _object(
+        attributes={
+            "type": "array",
+            "items": _object(
+                attribute=_STRING,
+                condition={"type": ["string", "null"]},
+                value={
+                    "type": ["string", "number", "boolean", "array", "null"],
+                    "items": {"type": "string"},
+                },
+            ),
+        }
+    ),
+}
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def response_schema(stage: str) -> Dict[str, Any]:
+    """The JSON schema the `stage` response must follow, with `explanation` unless explanations are omitted."""
+    schema = copy.deepcopy(STAGE_SCHEMAS[stage])
+    if not OMIT_EXPLANATIONS:
+        schema["properties"]["explanation"] = _STRING
+        schema["required"].append("explanation")
+    return schema
+
+
+def _validate(value: Any, schema: Dict[str, Any], path: str):
+    """Check the subset of JSON schema used in `STAGE_SCHEMAS`."""
+    types = schema.get("type", [])
+    types = [types] if isinstance(types, str) else types
+    if types and not any(
+        isinstance(value, _JSON_TYPES[name]) and not (name in ("integer", "number") and isinstance(value, bool))
+        for name in types
+    ):
+        raise ValueError(f"{path} should be {' or '.join(types)}, got {type(value).__name__}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise ValueError(f"{path} should be one of {', '.join(map(str, schema['enum']))}, got {value!r}")
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                raise ValueError(f"{path} is missing {key!r}")
+        for key, property_schema in schema.get("properties", {}).items():
+            if key in value:
+                _validate(value[key], property_schema, f"{path}.{key}")
+    if isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            _validate(item, schema["items"], f"{path}[{i}]")
+
+
+def parse_response(stage: str, text: str) -> Dict[str, Any]:
+    """
+    Parse and validate a stage's completion.
+
+    Raises:
+        ValueError: If the completion is not JSON or does not follow the stage's schema.
+    """
+    try:
+        response = json.loads(extract_json_str(text))
+        _validate(response, response_schema(stage), "response")
+    except ValueError as e:
+        raise ValueError(f"Invalid response from model at {stage} stage: {e}") from e
+    return response
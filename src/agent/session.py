@@ -0,0 +1,288 @@
+"""
+Conversational follow-ups.
+
+The chat UI sends a session id with every message. After a successful
+translation the stage outputs are kept in a `SessionStore` under that id, so a
+follow-up such as "now only the ones from the last two years" does not start
+from an empty state. `plan_follow_up` decides, with cheap rules and no LLM
+call, which stages the follow-up changes; `run_follow_up` re-runs only those
+on a copy of the previous state and rebuilds the query with `construct_query`
+and `construct_url`. Anything the rules do not recognise as a follow-up is
+translated from scratch and starts a new conversation. Only the standalone
+query and its last few follow-ups are kept, so the text the stages read stays
+bounded however long the chat goes on.
+
+Sessions are kept per process, so with several workers the app needs sticky
+sessions for follow-ups to find their session.
+"""
+
+import copy
+import functools
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+
+from agent.component_helpers import (
+    STAGE_OUTPUTS,
+    attribute_api_call,
+    attribute_cache_key,
+    construct_query,
+    construct_url,
+    identify_attributes,
+    identify_entity,
+    identify_index,
+    identify_intent,
+    identify_rank,
+    identify_record,
+    identify_time_frame,
+    rank_cache_key,
+    record_cache_key,
+)
+from agent.goat_query_component import run_and_report
+from agent.metrics import registry
+
+logger = logging.getLogger("goat_nlp.session")
+
+# State kept per session: every stage output, plus what `construct_query` needs to reuse the lineage.
+SESSION_KEYS = tuple(dict.fromkeys(key for keys in STAGE_OUTPUTS.values() for key in keys))
+# Order follow-up stages run in; each only reads the outputs of the stages before it.
+FOLLOW_UP_ORDER = ("intent", "index", "entity", "time", "rank", "attribute")
+# Stages whose result depends on the output of another stage.
+DEPENDENTS = {"index": ("rank", "attribute"), "entity": ("rank",)}
+
+# Follow-up messages from the same session joined to the standalone query they refine; older ones are dropped.
+SESSION_MAX_FOLLOW_UPS = int(os.getenv("SESSION_MAX_FOLLOW_UPS", 3))
+# Longer messages are translated on their own.
+FOLLOW_UP_MAX_WORDS = 10
+
+# Words only a follow-up starts with.
+_FOLLOW_UP = re.compile(
+    r"^\s*(?:(?:and|but)\s+)?(?:now|only|just|also|same|instead|then|ok(?:ay)?|what about|how about)\b",
+    re.IGNORECASE,
+)
+# Words a follow-up often starts with, but so do standalone questions, e.g. "In which orders ...".
+_MAYBE_FOLLOW_UP = re.compile(
+    r"^\s*(?:and|but|in|from|since|before|after|between|with|without|for|excluding|including)\b", re.IGNORECASE
+)
+# What makes a message a complete question of its own.
+_QUESTION = re.compile(
+    r"\b(?:how many|how much|how large|how big|which|what|who|where|when|list|show|count|find|give me|"
+    r"are there|is there|do|does)\b",
+    re.IGNORECASE,
+)
+# Replacing the subject rather than refining the previous query.
+_SWITCH = re.compile(r"^\s*(?:what|how) about\b|\binstead\b", re.IGNORECASE)
+_STAGE_RULES = {
+    "time": re.compile(
+        r"\b(?:\d{4}|years?|months?|weeks?|days?|decades?|since|before|after|until|till|last|past|ago|"
+        r"recent(?:ly)?|today|yesterday|january|february|march|april|may|june|july|august|september|"
+        r"october|november|december)\b",
+        re.IGNORECASE,
+    ),
+    "rank": re.compile(
+        r"\b(?:species|subspecies|genus|genera|famil(?:y|ies)|orders?|class(?:es)?|phyl(?:um|a)|kingdoms?|"
+        r"ranks?)\b",
+        re.IGNORECASE,
+    ),
+    "index": re.compile(r"\b(?:taxa|taxon|taxons|assembl(?:y|ies)(?! level| span)|samples?)\b", re.IGNORECASE),
+    "intent": re.compile(r"\b(?:how many|count|number of|list|show|records?|details?)\b", re.IGNORECASE),
+    # Comparisons; attribute names are matched per index, see `_attribute_words`.
+    "attribute": re.compile(
+        r"[<>=]|\b(?:more|less|greater|fewer|larger|smaller|bigger|at least|at most|above|below|over|under|"
+        r"exactly|equal|missing)\b",
+        re.IGNORECASE,
+    ),
+}
+# Words that say nothing about any stage; whatever else is left names a new entity.
+_FILLER = re.compile(
+    r"\b(?:now|only|just|and|but|also|same|instead|then|ok(?:ay)?|what|how|about|in|from|to|of|the|a|an|"
+    r"those|these|them|ones?|that|this|it|they|there|are|is|be|was|were|for|by|on|at|please|than|"
+    r"with|without|having|has|have|between|excluding|including|all|any|one|two|three|four|five|six|seven|"
+    r"eight|nine|ten|eleven|twelve|twenty|fifty|hundred|thousand|million|billion|"
+    r"\d+(?:\.\d+)?\s*(?:[kmg]b|bp|%)?)\b|[^\w\s]",
+    re.IGNORECASE,
+)
+
+
+class SessionStore:
+    """
+    Bounded in-memory store of the last translation of each session.
+
+    Args:
+        max_sessions (int): Sessions kept before the least recently used are dropped.
+        ttl (int): Seconds a session is kept after its last translation.
+    """
+
+    def __init__(self, max_sessions: int, ttl: int):
+        self._sessions: TTLCache = TTLCache(maxsize=max_sessions, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The session's last input and state, as a copy."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        return copy.deepcopy(session)
+
+    def put(self, session_id: str, messages: List[str], state: Dict[str, Any]):
+        """
+        Keep `messages` and the stage outputs of their `state` as the session's last translation.
+
+        Args:
+            session_id (str): The session.
+            messages (list): The standalone query, then the follow-ups that refined it.
+            state (dict): The translation of `messages`.
+        """
+        messages = list(messages)
+        session = {"messages": messages, "state": copy.deepcopy({k: state[k] for k in SESSION_KEYS if k in state})}
+        with self._lock:
+            self._sessions[session_id] = session
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+@functools.lru_cache(maxsize=None)
+def get_session_store() -> Optional[SessionStore]:
+    """The process-wide session store, or None when `SESSION_MAX_SESSIONS` is 0."""
+    max_sessions = int(os.getenv("SESSION_MAX_SESSIONS", 1000))
+    if max_sessions <= 0:
+        return None
+    return SessionStore(max_sessions, int(os.getenv("SESSION_TTL", 30 * 60)))
+
+
+def conversation(previous: Dict[str, Any], query: str) -> List[str]:
+    """
+    The messages a follow-up is read with: the standalone query it refines and
+    at most `SESSION_MAX_FOLLOW_UPS` follow-ups, the last one being `query`.
+    """
+    standalone, *follow_ups = previous["messages"] + [query]
+    return [standalone] + follow_ups[-max(SESSION_MAX_FOLLOW_UPS, 1) :]
+
+
+def is_follow_up(query: str) -> bool:
+    """
+    Whether `query` reads as refining the previous query rather than as a question of its own.
+
+    Only short messages qualify. They have to start with a word only follow-ups
+    start with, e.g. "now" or "what about", or with one such as "in" or "with"
+    that is not followed by a complete question.
+    """
+    if len(query.split()) > FOLLOW_UP_MAX_WORDS:
+        return False
+    if _FOLLOW_UP.match(query):
+        return True
+    return bool(_MAYBE_FOLLOW_UP.match(query)) and not _QUESTION.search(query)
+
+
+def _attribute_words(index: str) -> re.Pattern:
+    """Pattern matching the words of the index's attribute names, e.g. "genome" and "size"."""
+    try:
+        fields = attribute_api_call(index)["fields"]
+    except Exception:
+        fields = {}
+    words = {word for name in fields for word in name.lower().split("_") if len(word) > 2}
+    return re.compile(r"\b(?:" + "|".join(sorted(map(re.escape, words))) + r")\b" if words else r"(?!)", re.I)
+
+
+def plan_follow_up(query: str, previous: Dict[str, Any]) -> Optional[List[str]]:
+    """
+    Stages a follow-up changes, in the order they have to run, without calling the LLM.
+
+    Args:
+        query (str): The new message.
+        previous (dict): The session's last translation, see `SessionStore.get`.
+
+    Returns:
+        list: The stages to re-run, or None when `query` does not read as a follow-up
+        and has to be translated from scratch.
+    """
+    state = previous["state"]
+    if "final_url" not in state or "intent" not in state or "index" not in state or "entity" not in state:
+        return None
+    if not is_follow_up(query):
+        return None
+
+    attribute_words = _attribute_words(state["index"]["classification"])
+    stages = {stage for stage, rule in _STAGE_RULES.items() if rule.search(query)}
+    leftover = query
+    for rule in _STAGE_RULES.values():
+        leftover = rule.sub(" ", leftover)
+    # Checked after the other rules, so e.g. "number of" stays an intent.
+    if attribute_words.search(leftover):
+        stages.add("attribute")
+    leftover = _FILLER.sub(" ", attribute_words.sub(" ", leftover))
+    # Next to an attribute constraint, leftover words are more likely its values than a new entity.
+    if leftover.strip() and ("attribute" not in stages or _SWITCH.search(query)):
+        stages.add("entity")
+    elif not stages:
+        return None
+
+    for stage in list(stages):
+        stages.update(DEPENDENTS.get(stage, ()))
+    if state["intent"]["intent"] == "record":
+        # Record lookups have no rank, attribute or time frame to refine.
+        stages = {stage for stage in stages if stage in ("intent", "index", "entity")}
+        if not stages:
+            return None
+    return [stage for stage in FOLLOW_UP_ORDER if stage in stages]
+
+
+_STAGE_FNS = {
+    "intent": (identify_intent, None),
+    "index": (identify_index, None),
+    "entity": (identify_entity, None),
+    "time": (identify_time_frame, None),
+    "rank": (identify_rank, rank_cache_key),
+    "attribute": (identify_attributes, attribute_cache_key),
+}
+
+
+def run_follow_up(query: str, previous: Dict[str, Any], stages: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Re-run `stages` on a copy of the previous state and rebuild the URL.
+
+    Entity and time frame are read from the follow-up alone, as they replace
+    the previous ones; the other stages read the conversation, see `conversation`.
+
+    Returns:
+        dict: The new state, with the earlier messages it was read with in `state["follow_up_of"]`,
+        or None when the follow-up switched between record and search/count,
+        which needs the whole pipeline.
+
+    Raises:
+        Exception: Whatever the re-run stages raise.
+    """
+    state = copy.deepcopy(previous["state"])
+    for stage in stages:
+        for key in STAGE_OUTPUTS[stage]:
+            state.pop(key, None)
+    state.pop("final_url", None)
+    messages = conversation(previous, query)
+    text = " ".join(messages)
+    was_record = previous["state"]["intent"]["intent"] == "record"
+
+    for stage in stages:
+        fn, cache_key = _STAGE_FNS[stage]
+        input = query if stage in ("entity", "time") else text
+        run_and_report(stage, fn, input, state, cache_key)
+        if stage == "entity" and not state["entity"].get("entities"):
+            # Nothing new named after all, e.g. "what about in 2020": keep the previous subject.
+            state["entity"] = copy.deepcopy(previous["state"]["entity"])
+        if stage == "intent" and (state["intent"]["intent"] == "record") != was_record:
+            return None
+
+    if state["intent"]["intent"] == "record":
+        run_and_report("record", identify_record, text, state, record_cache_key)
+    else:
+        run_and_report("query", construct_query, text, state)
+        run_and_report("url", construct_url, text, state)
+    state["follow_up_of"] = " ".join(messages[:-1])
+    registry.increment(
+        "goat_nlp_follow_up_total", "Follow-up queries answered from session state.", stages=",".join(stages)
+    )
+    return state
@@ -0,0 +1,49 @@
+"""
+Shared plumbing of the SQLite-backed caches (`agent.response_cache`, `agent.stage_cache`).
+
+The database file is shared by every worker process on the host; each thread
+keeps its own connection in WAL mode so readers never block the writer.
+"""
+
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    Base class of a SQLite-backed cache with a TTL and least-recently-used eviction.
+
+    Subclasses create their table in `__init__` and keep an `accessed_at` column
+    up to date on every hit.
+
+    Args:
+        path (str): Database file.
+        ttl (int): Seconds an entry stays valid.
+        max_entries (int): Entries kept before the least recently used are evicted.
+    """
+
+    def __init__(self, path: str, ttl: int, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _evict_least_recent(self, connection: sqlite3.Connection, table: str):
+        """Delete all but the `max_entries` most recently accessed rows of `table`."""
+        connection.execute(
+            f"""
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
@@ -0,0 +1,140 @@
+"""
+Memoization of individual pipeline stages.
+
+A component built with a `cache_key` function looks its stage up here before
+running it. The key function returns what the stage's result actually depends
+on, e.g. the query and the candidate taxa for the rank stage, so overlapping
+requests share the stages they have in common rather than only exact repeats
+of the whole request (see `agent.response_cache`). Keys also cover the prompt
+and model fingerprint.
+
+`STAGE_CACHE` selects the backend: `off` (default), `memory` (per process) or
+`sqlite` (shared by the worker processes on a host, at `STAGE_CACHE_PATH`).
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+from agent.metrics import registry
+from agent.response_cache import pipeline_fingerprint
+from agent.sqlite_store import SQLiteStore
+
+logger = logging.getLogger("goat_nlp.stage_cache")
+
+
+def hash_key(stage: str, key: Any) -> str:
+    """Hash of a stage's key, the stage name and the prompt/model fingerprint."""
+    payload = json.dumps([stage, pipeline_fingerprint(), key], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MemoryStageCache:
+    """
+    In-process LRU cache of stage outputs with a TTL.
+
+    Args:
+        ttl (int): Seconds an entry stays valid.
+        max_entries (int): Entries kept before the least recently used are evicted.
+    """
+
+    def __init__(self, ttl: int, max_entries: int):
+        self._cache: TTLCache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, stage: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._cache.get((stage, key))
+        # Stored as JSON, so callers never share objects with the cache.
+        return json.loads(value) if value is not None else None
+
+    def put(self, stage: str, key: str, outputs: Dict[str, Any]):
+        value = json.dumps(outputs, default=str)
+        with self._lock:
+            self._cache[(stage, key)] = value
+
+
+class SQLiteStageCache(SQLiteStore):
+    """
+    SQLite-backed cache of stage outputs, shared by every worker process on the host.
+
+    Args:
+        path (str): Database file.
+        ttl (int): Seconds an entry stays valid.
+        max_entries (int): Entries kept before the least recently used are evicted.
+    """
+
+    def __init__(self, path: str, ttl: int, max_entries: int):
+        super().__init__(path, ttl, max_entries)
+        with self._connection() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stage_outputs (
+                    stage TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    outputs TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (stage, key)
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS stage_outputs_accessed_at ON stage_outputs (accessed_at)")
+
+    def get(self, stage: str, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT outputs FROM stage_outputs WHERE stage = ? AND key = ? AND created_at >= ?",
+                (stage, key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE stage_outputs SET accessed_at = ? WHERE stage = ? AND key = ?", (now, stage, key)
+            )
+        except sqlite3.Error:
+            logger.exception("Stage cache lookup failed")
+            return None
+        return json.loads(row[0])
+
+    def put(self, stage: str, key: str, outputs: Dict[str, Any]):
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO stage_outputs VALUES (?, ?, ?, ?, ?)",
+                (stage, key, json.dumps(outputs, default=str), now, now),
+            )
+            connection.execute("DELETE FROM stage_outputs WHERE created_at < ?", (now - self.ttl,))
+            self._evict_least_recent(connection, "stage_outputs")
+        except sqlite3.Error:
+            logger.exception("Stage cache write failed")
+
+
+def count(stage: str, result: str):
+    registry.increment("goat_nlp_stage_cache_total", "Stage cache lookups, by result.", stage=stage, result=result)
+
+
+@functools.lru_cache(maxsize=None)
+def get_stage_cache():
+    """The backend selected by `STAGE_CACHE`, or None when stage memoization is off."""
+    mode = os.getenv("STAGE_CACHE", "off").lower()
+    ttl = int(os.getenv("STAGE_CACHE_TTL", 24 * 60 * 60))
+    max_entries = int(os.getenv("STAGE_CACHE_MAX_ENTRIES", 10000))
+    if mode == "off":
+        return None
+    if mode == "memory":
+        return MemoryStageCache(ttl, max_entries)
+    if mode == "sqlite":
+        return SQLiteStageCache(os.getenv("STAGE_CACHE_PATH", "stage_cache.sqlite3"), ttl, max_entries)
+    raise ValueError(f"STAGE_CACHE must be off, memory or sqlite, not {mode!r}")
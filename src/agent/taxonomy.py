@@ -0,0 +1,281 @@
+"""
+Local, memory-mapped taxonomy store.
+
+Built once from an NCBI taxdump (`nodes.dmp`/`names.dmp`) or a GoaT taxon dump
+(JSON lines, one taxon record per line) into a directory of flat arrays:
+
+- `parents.npy`, `ranks.npy`: parent taxon ID and rank code, indexed by taxon ID
+- `scientific_offsets.npy` + `scientific_names.bin`: scientific name per taxon ID
+- `name_offsets.npy` + `names.bin` + `name_taxids.npy`: every name, sorted by its
+  casefolded form, with the taxon ID it belongs to
+- `taxon_name_order.npy` + `taxon_name_taxids.npy`: positions of the names above,
+  sorted by taxon ID, and the matching taxon IDs
+- `name_suffix_order.npy`: positions of the names above, sorted by their reversed
+  casefolded form, for `* name` wildcard searches
+- `child_parents.npy` + `child_taxids.npy`: taxon IDs sorted by parent, for `tax_tree`
+- `ranks.json`: the rank code -> rank name table
+
+Every file is opened with `mmap`, so all worker processes on a host share one copy
+through the page cache and opening the store costs next to nothing.
+
+Usage:
+    python -m agent.taxonomy ncbi --nodes nodes.dmp --names names.dmp --out taxonomy
+    python -m agent.taxonomy goat --dump taxa.jsonl --out taxonomy
+"""
+
+import argparse
+import functools
+import json
+import logging
+import mmap
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("goat_nlp.taxonomy")
+
+# (taxon_id, parent_taxon_id, rank, scientific_name, [other names])
+TaxonRow = Tuple[int, int, str, str, List[str]]
+
+
+def _name_key(name: str) -> bytes:
+    return name.casefold().encode()
+
+
+def read_ncbi_taxdump(nodes_path: str, names_path: str) -> Iterator[TaxonRow]:
+    names: Dict[int, List[str]] = {}
+    scientific_names: Dict[int, str] = {}
+    with open(names_path, encoding="utf-8") as names_file:
+        for line in names_file:
+            taxon_id, name, _, name_class = line.rstrip("\t|\n").split("\t|\t")[:4]
+            if name_class == "scientific name":
+                scientific_names[int(taxon_id)] = name
+            else:
+                names.setdefault(int(taxon_id), []).append(name)
+
+    with open(nodes_path, encoding="utf-8") as nodes_file:
+        for line in nodes_file:
+            taxon_id, parent, rank = line.rstrip("\t|\n").split("\t|\t")[:3]
+            taxon_id = int(taxon_id)
+            yield taxon_id, int(parent), rank, scientific_names.get(taxon_id, ""), names.get(taxon_id, [])
+
+
+def read_goat_dump(dump_path: str) -> Iterator[TaxonRow]:
+    with open(dump_path, encoding="utf-8") as dump_file:
+        for line in dump_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record = record.get("result", record)
+            scientific_name = record["scientific_name"]
+            yield (
+                int(record["taxon_id"]),
+                int(record.get("parent") or record["taxon_id"]),
+                record.get("taxon_rank", "no rank"),
+                scientific_name,
+                [x["name"] for x in record.get("taxon_names", []) if x["name"] != scientific_name],
+            )
+
+
+def build_store(rows: Iterable[TaxonRow], out_dir: str):
+    """Write the store files for `rows` into `out_dir`."""
+    os.makedirs(out_dir, exist_ok=True)
+    rows = list(rows)
+    max_taxon_id = max(row[0] for row in rows)
+
+    rank_codes: Dict[str, int] = {}
+    parents = np.full(max_taxon_id + 1, -1, dtype=np.int32)
+    ranks = np.zeros(max_taxon_id + 1, dtype=np.uint8)
+    scientific_names = [b""] * (max_taxon_id + 1)
+    name_entries = []
+    for taxon_id, parent, rank, scientific_name, other_names in rows:
+        parents[taxon_id] = parent
+        ranks[taxon_id] = rank_codes.setdefault(rank, len(rank_codes))
+        scientific_names[taxon_id] = scientific_name.encode()
+        for name in {scientific_name, *other_names}:
+            if name:
+                name_entries.append((_name_key(name), name.encode(), taxon_id))
+    name_entries.sort()
+
+    np.save(os.path.join(out_dir, "parents.npy"), parents)
+    np.save(os.path.join(out_dir, "ranks.npy"), ranks)
+    with open(os.path.join(out_dir, "ranks.json"), "w") as ranks_file:
+        json.dump(sorted(rank_codes, key=rank_codes.get), ranks_file)
+
+    _write_blob(out_dir, "scientific_offsets.npy", "scientific_names.bin", scientific_names)
+    _write_blob(out_dir, "name_offsets.npy", "names.bin", [name for _, name, _ in name_entries])
+    name_taxids = np.array([taxon_id for _, _, taxon_id in name_entries], dtype=np.int32)
+    taxon_name_order = np.argsort(name_taxids, kind="stable").astype(np.int32)
+    np.save(os.path.join(out_dir, "name_taxids.npy"), name_taxids)
+    np.save(os.path.join(out_dir, "taxon_name_order.npy"), taxon_name_order)
+    np.save(os.path.join(out_dir, "taxon_name_taxids.npy"), name_taxids[taxon_name_order])
+    suffix_order = sorted(range(len(name_entries)), key=lambda position: name_entries[position][0][::-1])
+    np.save(os.path.join(out_dir, "name_suffix_order.npy"), np.array(suffix_order, dtype=np.int32))
+
+    taxon_ids = np.flatnonzero((parents >= 0) & (parents != np.arange(len(parents)))).astype(np.int32)
+    child_order = np.argsort(parents[taxon_ids], kind="stable")
+    np.save(os.path.join(out_dir, "child_parents.npy"), parents[taxon_ids][child_order])
+    np.save(os.path.join(out_dir, "child_taxids.npy"), taxon_ids[child_order])
+
+    logger.info(f"Built taxonomy store with {len(rows)} taxa and {len(name_entries)} names in {out_dir}")
+
+
+def _write_blob(out_dir: str, offsets_name: str, blob_name: str, values: List[bytes]):
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+    np.save(os.path.join(out_dir, offsets_name), offsets)
+    with open(os.path.join(out_dir, blob_name), "wb") as blob_file:
+        # mmap cannot map an empty file
+        blob_file.write(b"".join(values) or b"\0")
+
+
+class TaxonomyStore:
+    """
+    Read-only view over a store built by `build_store`.
+
+    Args:
+        path (str): Directory containing the store files.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.parents = np.load(os.path.join(path, "parents.npy"), mmap_mode="r")
+        self.ranks = np.load(os.path.join(path, "ranks.npy"), mmap_mode="r")
+        with open(os.path.join(path, "ranks.json")) as ranks_file:
+            self.rank_names = json.load(ranks_file)
+        self.scientific_offsets = np.load(os.path.join(path, "scientific_offsets.npy"), mmap_mode="r")
+        self.scientific_blob = self._map(os.path.join(path, "scientific_names.bin"))
+        self.name_offsets = np.load(os.path.join(path, "name_offsets.npy"), mmap_mode="r")
+        self.name_blob = self._map(os.path.join(path, "names.bin"))
+        self.name_taxids = np.load(os.path.join(path, "name_taxids.npy"), mmap_mode="r")
+        self.taxon_name_order = np.load(os.path.join(path, "taxon_name_order.npy"), mmap_mode="r")
+        self.taxon_name_taxids = np.load(os.path.join(path, "taxon_name_taxids.npy"), mmap_mode="r")
+        self.name_suffix_order = np.load(os.path.join(path, "name_suffix_order.npy"), mmap_mode="r")
+        self.child_parents = np.load(os.path.join(path, "child_parents.npy"), mmap_mode="r")
+        self.child_taxids = np.load(os.path.join(path, "child_taxids.npy"), mmap_mode="r")
+
+    @staticmethod
+    def _map(path: str) -> mmap.mmap:
+        with open(path, "rb") as blob_file:
+            return mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, taxon_id: int) -> bool:
+        return 0 <= taxon_id < len(self.parents) and self.parents[taxon_id] >= 0
+
+    def _name(self, position: int) -> str:
+        return self.name_blob[self.name_offsets[position] : self.name_offsets[position + 1]].decode()
+
+    def _bisect(self, key: bytes) -> int:
+        """Leftmost position whose casefolded name is >= `key`."""
+        low, high = 0, len(self.name_taxids)
+        while low < high:
+            middle = (low + high) // 2
+            if _name_key(self._name(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, name: str) -> List[int]:
+        """Taxon IDs with a name matching `name` (case-insensitive)."""
+        key = _name_key(name)
+        position = self._bisect(key)
+        taxon_ids = []
+        while position < len(self.name_taxids) and _name_key(self._name(position)) == key:
+            taxon_ids.append(int(self.name_taxids[position]))
+            position += 1
+        return list(dict.fromkeys(taxon_ids))
+
+    def lookup_suffix(self, suffix: str, limit: int) -> List[int]:
+        """Up to `limit` taxon IDs with a name ending in `suffix` (case-insensitive), as for `tax_name(* suffix)`."""
+        key = _name_key(suffix)[::-1]
+        low, high = 0, len(self.name_suffix_order)
+        while low < high:
+            middle = (low + high) // 2
+            if _name_key(self._name(int(self.name_suffix_order[middle])))[::-1] < key:
+                low = middle + 1
+            else:
+                high = middle
+        taxon_ids: List[int] = []
+        while low < len(self.name_suffix_order) and len(taxon_ids) < limit:
+            position = int(self.name_suffix_order[low])
+            if not _name_key(self._name(position))[::-1].startswith(key):
+                break
+            if int(self.name_taxids[position]) not in taxon_ids:
+                taxon_ids.append(int(self.name_taxids[position]))
+            low += 1
+        return taxon_ids
+
+    def tree(self, taxon_ids: List[int], limit: int) -> List[int]:
+        """Up to `limit` of `taxon_ids` and their descendants, breadth first, as for `tax_tree`."""
+        found = list(dict.fromkeys(taxon_ids))[:limit]
+        queue = list(found)
+        while queue and len(found) < limit:
+            parent = queue.pop(0)
+            start, end = np.searchsorted(self.child_parents, [parent, parent + 1])
+            for child in self.child_taxids[start : min(end, start + limit - len(found))]:
+                found.append(int(child))
+                queue.append(int(child))
+        return found
+
+    def scientific_name(self, taxon_id: int) -> str:
+        start, end = self.scientific_offsets[taxon_id], self.scientific_offsets[taxon_id + 1]
+        return self.scientific_blob[start:end].decode()
+
+    def rank(self, taxon_id: int) -> str:
+        return self.rank_names[self.ranks[taxon_id]]
+
+    def names(self, taxon_id: int) -> List[str]:
+        start, end = np.searchsorted(self.taxon_name_taxids, [taxon_id, taxon_id + 1])
+        return [self._name(int(position)) for position in self.taxon_name_order[start:end]]
+
+    def lineage(self, taxon_id: int) -> List[Dict[str, Any]]:
+        """Ancestors of `taxon_id` from its parent up to the root, shaped like GoaT's `lineage` field."""
+        lineage = []
+        parent = int(self.parents[taxon_id])
+        while parent != taxon_id and parent >= 0:
+            lineage.append(
+                {
+                    "taxon_id": str(parent),
+                    "taxon_rank": self.rank(parent),
+                    "scientific_name": self.scientific_name(parent),
+                    "node_depth": len(lineage) + 1,
+                }
+            )
+            taxon_id, parent = parent, int(self.parents[parent])
+        return lineage
+
+
+@functools.lru_cache(maxsize=None)
+def get_taxonomy_store() -> Optional[TaxonomyStore]:
+    """The store at `TAXONOMY_PATH`, or None when no local taxonomy is configured."""
+    path = os.getenv("TAXONOMY_PATH")
+    if not path:
+        return None
+    try:
+        store = TaxonomyStore(path)
+    except OSError:
+        logger.exception(f"Could not open taxonomy store at {path}, using the GoaT API only")
+        return None
+    logger.info(f"Opened taxonomy store at {path}")
+    return store
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the local taxonomy store.")
+    subparsers = parser.add_subparsers(dest="source", required=True)
+    ncbi_parser = subparsers.add_parser("ncbi", help="Build from an NCBI taxdump")
+    ncbi_parser.add_argument("--nodes", required=True, help="Path to nodes.dmp")
+    ncbi_parser.add_argument("--names", required=True, help="Path to names.dmp")
+    goat_parser = subparsers.add_parser("goat", help="Build from a GoaT taxon dump (JSON lines)")
+    goat_parser.add_argument("--dump", required=True, help="Path to the JSON lines dump")
+    for subparser in (ncbi_parser, goat_parser):
+        subparser.add_argument("--out", required=True, help="Output directory")
+    args = parser.parse_args()
+
+    if args.source == "ncbi":
+        build_store(read_ncbi_taxdump(args.nodes, args.names), args.out)
+    else:
+        build_store(read_goat_dump(args.dump), args.out)
@@ -0,0 +1,70 @@
+"""
+OpenTelemetry tracing of the LlamaIndex pipeline, exported to Phoenix.
+
+`TRACING_MODE` selects how much is traced:
+
+- `off`: no instrumentation; the tracing packages are not even imported
+- `sampled`: a `TRACING_SAMPLE_RATIO` share of traces
+- `full`: every trace
+
+Spans are exported by a `BatchSpanProcessor` on a background thread, so the
+request thread only pays for appending to a bounded queue; when the queue is
+full, spans are dropped rather than slowing requests down. The embedded Phoenix
+server is only launched when `PHOENIX_LAUNCH` is true; otherwise spans go to
+the collector at `TRACING_ENDPOINT`.
+"""
+
+import atexit
+import logging
+import os
+
+logger = logging.getLogger("goat_nlp.tracing")
+
+TRACING_MODES = ("off", "sampled", "full")
+
+
+def configure_tracing():
+    """
+    Install the LlamaIndex instrumentation for the configured `TRACING_MODE`.
+
+    Returns:
+        The `TracerProvider`, or None when tracing is off.
+    """
+    mode = os.getenv("TRACING_MODE", "full").lower()
+    if mode not in TRACING_MODES:
+        raise ValueError(f"TRACING_MODE must be one of {', '.join(TRACING_MODES)}, not {mode!r}")
+    if mode == "off":
+        logger.info("Tracing is off")
+        return None
+
+    from openinference.instrumentation.llama_index import LlamaIndexInstrumentor
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk import trace as trace_sdk
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import (
+        ALWAYS_ON,
+        ParentBased,
+        TraceIdRatioBased,
+    )
+
+    if os.getenv("PHOENIX_LAUNCH", "true").lower() == "true":
+        import phoenix as px
+
+        px.launch_app()
+
+    ratio = float(os.getenv("TRACING_SAMPLE_RATIO", 0.1))
+    sampler = ParentBased(TraceIdRatioBased(ratio)) if mode == "sampled" else ALWAYS_ON
+    tracer_provider = trace_sdk.TracerProvider(sampler=sampler)
+    tracer_provider.add_span_processor(
+        BatchSpanProcessor(
+            OTLPSpanExporter(os.getenv("TRACING_ENDPOINT", "http://127.0.0.1:6006/v1/traces")),
+            max_queue_size=int(os.getenv("TRACING_MAX_QUEUE_SIZE", 2048)),
+            max_export_batch_size=int(os.getenv("TRACING_EXPORT_BATCH_SIZE", 512)),
+        )
+    )
+    # Flush queued spans when the worker exits.
+    atexit.register(tracer_provider.shutdown)
+
+    LlamaIndexInstrumentor().instrument(tracer_provider=tracer_provider)
+    logger.info(f"Tracing {'every trace' if mode == 'full' else f'{ratio:.0%} of traces'}")
+    return tracer_provider
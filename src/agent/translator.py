@@ -0,0 +1,166 @@
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from agent.admission import AdmissionRejected
+from agent.deadline import DeadlineExceeded, check
+from agent.metrics import record_translation
+from agent.query_index import match_known_translation
+from agent.query_pipeline import qp
+from agent.response_cache import ResponseCache
+from agent.session import (
+    SessionStore,
+    conversation,
+    get_session_store,
+    plan_follow_up,
+    run_follow_up,
+)
+
+logger = logging.getLogger("goat_nlp.translator")
+
+response_cache = ResponseCache.from_env()
+
+
+class TranslationError(Exception):
+    """Raised when the pipeline could not produce a GoaT URL within the retry limit."""
+
+
+class ServiceOverloaded(TranslationError):
+    """
+    Raised when the LLM admission queue rejected a call.
+
+    Args:
+        message (str): Error message.
+        status (int): HTTP status to answer with (429 or 503).
+    """
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+def translate(query: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Translate a natural language query into a GoaT URL.
+
+    With a `session_id`, a query that follows up on the session's previous one
+    only re-runs the stages it changes (see `agent.session`); otherwise, or if
+    that fails, the conversation so far is translated from scratch.
+
+    Args:
+        query (str): The user's query.
+        session_id (str, optional): Conversation the query belongs to.
+
+    Returns:
+        dict: The final pipeline state, including `final_url`.
+
+    Raises:
+        TranslationError: If every attempt failed.
+        DeadlineExceeded: If the request deadline passed or the request was cancelled.
+    """
+    store = get_session_store() if session_id else None
+    previous = store.get(session_id) if store is not None else None
+    stages = plan_follow_up(query, previous) if previous is not None else None
+    messages = [query]
+    if stages is not None:
+        state = _translate_follow_up(query, previous, stages)
+        messages = conversation(previous, query)
+        if state is not None:
+            _remember(store, session_id, messages, state)
+            return state
+
+    try:
+        state = _translate(" ".join(messages))
+    except Exception:
+        if store is not None:
+            store.clear(session_id)
+        raise
+    if store is not None:
+        _remember(store, session_id, messages, state)
+    return state
+
+
+def _remember(store: SessionStore, session_id: str, messages: List[str], state: Dict[str, Any]):
+    # Known translations carry no stage outputs to follow up on, and skipped stages would be missing.
+    if "intent" in state and not state.get("degraded"):
+        store.put(session_id, messages, state)
+    else:
+        store.clear(session_id)
+
+
+def _translate_follow_up(query: str, previous: Dict[str, Any], stages: List[str]) -> Optional[Dict[str, Any]]:
+    """The state of a follow-up, or None when it has to be translated from scratch."""
+    logger.info(f"Follow-up {query!r} to {' '.join(previous['messages'])!r} re-runs {stages}")
+    state = {}
+    start = time.perf_counter()
+    try:
+        check("translation")
+        state = run_follow_up(query, previous, stages)
+    except AdmissionRejected as e:
+        record_translation(previous["state"], time.perf_counter() - start, "rejected")
+        raise ServiceOverloaded(str(e), e.status) from e
+    except DeadlineExceeded:
+        record_translation(previous["state"], time.perf_counter() - start, "timeout")
+        raise
+    except Exception as e:
+        logger.warning(f"Follow-up failed, translating the conversation instead: {e}")
+        record_translation(previous["state"], time.perf_counter() - start, "error")
+        return None
+    if state is None:
+        return None
+    state["final_url"] = str(state["final_url"])
+    logger.info(f"Token usage by stage: {state.get('usage', {})}")
+    record_translation(state, time.perf_counter() - start, "follow_up")
+    return state
+
+
+def _translate(query: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    if response_cache is not None and (cached := response_cache.get(query)) is not None:
+        record_translation(cached["state"], time.perf_counter() - start, "cached")
+        return cached["state"]
+
+    match = match_known_translation(query)
+    if match is not None and match["accepted"]:
+        logger.info(f"Known translation matched {match['english_query']!r} at distance {match['distance']:.4f}")
+        state = {"final_url": match["api_query"], "nearest_translation": match}
+        record_translation(state, time.perf_counter() - start, "matched")
+        return state
+
+    exception = None
+    # Failing stages are retried in place (STAGE_RETRY_LIMIT); this restarts the whole pipeline.
+    for _ in range(int(os.getenv("RETRY_LIMIT", 1))):
+        check("translation")
+        state = {}
+        attempt_start = time.perf_counter()
+        try:
+            response = qp.run(input={"input": query, "state": state})
+            logger.info(response)
+            state = response["state"]
+            if state.get("retries"):
+                logger.info(f"Stage retries: {state['retries']}")
+            if response["error"]:
+                if "overloaded" in state:
+                    record_translation(state, time.perf_counter() - attempt_start, "rejected")
+                    raise ServiceOverloaded(response["exception"], state["overloaded"])
+                if state.get("deadline_exceeded"):
+                    record_translation(state, time.perf_counter() - attempt_start, "timeout")
+                    raise DeadlineExceeded(response["exception"])
+                raise RuntimeError(response["exception"])
+            if match is not None:
+                state["nearest_translation"] = match
+            state["final_url"] = str(state["final_url"])
+            logger.info(f"Token usage by stage: {state.get('usage', {})}")
+            if state.get("degraded"):
+                logger.warning(f"Degraded stages: {state['degraded']}")
+            elif response_cache is not None:
+                response_cache.put(query, state)
+            record_translation(state, time.perf_counter() - attempt_start, "ok")
+            return state
+        except (ServiceOverloaded, DeadlineExceeded):
+            raise
+        except Exception as e:
+            record_translation(state, time.perf_counter() - attempt_start, "error")
+            exception = e
+    raise TranslationError(f"Could not translate query: {query!r}") from exception
@@ -0,0 +1,76 @@
+"""
+Warm-up steps run once at startup, before the app reports itself ready.
+
+- Preload the attribute metadata of every index, which also opens the pooled
+  (TLS) connections to the GoaT API.
+- Ask Ollama to load the model and keep it resident for `OLLAMA_KEEP_ALIVE`.
+- Run a canned query through the pipeline, so the first user request does not
+  pay for the first completion, search or prompt formatting.
+
+Heavy modules are imported inside the steps, so importing this module is cheap.
+"""
+
+import logging
+import os
+import time
+from typing import Any, Callable, Dict
+
+import requests
+
+logger = logging.getLogger("goat_nlp.warmup")
+
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "How many species of birds have been sequenced?")
+
+
+def preload_attributes():
+    from agent.component_helpers import INDICES, attribute_api_call
+
+    for index in INDICES:
+        attribute_api_call(index)
+
+
+def keep_model_resident():
+    base_url = os.getenv("OLLAMA_HOST_URL", "http://127.0.0.1:11434").rstrip("/")
+    # A generate request without a prompt only loads the model.
+    response = requests.post(
+        f"{base_url}/api/generate",
+        json={"model": os.getenv("OLLAMA_MODEL", "llama3"), "keep_alive": os.getenv("OLLAMA_KEEP_ALIVE", "30m")},
+        timeout=float(os.getenv("WARMUP_TIMEOUT", 600)),
+    )
+    response.raise_for_status()
+
+
+def run_canned_query():
+    from agent.query_pipeline import qp
+
+    response = qp.run(input={"input": WARMUP_QUERY, "state": {}})
+    if response.get("error") or "final_url" not in response["state"]:
+        raise RuntimeError(f"Canned query failed: {response.get('exception')}")
+
+
+WARMUP_STEPS: Dict[str, Callable[[], None]] = {
+    "attributes": preload_attributes,
+    "ollama": keep_model_resident,
+    "query": run_canned_query,
+}
+
+
+def warm_up() -> Dict[str, Dict[str, Any]]:
+    """
+    Run every warm-up step, continuing past failures.
+
+    Returns:
+        dict: Step name -> `{"seconds": ..., "error": ...}`.
+    """
+    report = {}
+    for name, step in WARMUP_STEPS.items():
+        start = time.perf_counter()
+        error = None
+        try:
+            step()
+        except Exception as e:
+            logger.exception(f"Warm-up step {name} failed")
+            error = str(e)
+        report[name] = {"seconds": time.perf_counter() - start, "error": error}
+        logger.info(f"Warm-up step {name} took {report[name]['seconds']:.2f}s")
+    return report
@@ -1,32 +1,15 @@
+import json
 import logging
 import os
 import sys
+import threading
+import time
 
-import llama_index.core
-import phoenix as px
-from flask import Flask, render_template, request
-from llama_index.core import Settings
-from llama_index.llms.ollama import Ollama
-from openinference.instrumentation.llama_index import LlamaIndexInstrumentor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk import trace as trace_sdk
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from flask import Flask, Response, render_template, request
 
-from agent.query_pipeline import qp
-
-Settings.llm = Ollama(
-    model="llama3",
-    base_url=os.getenv("OLLAMA_HOST_URL", "http://127.0.0.1:11434"),
-    request_timeout=36000.0,
-)
-
-px.launch_app()
-llama_index.core.set_global_handler("arize_phoenix")
-endpoint = "http://127.0.0.1:6006/v1/traces"
-tracer_provider = trace_sdk.TracerProvider()
-tracer_provider.add_span_processor(SimpleSpanProcessor(OTLPSpanExporter(endpoint)))
-
-LlamaIndexInstrumentor().instrument(tracer_provider=tracer_provider)
+from agent.metrics import render_metrics
+from agent.tracing import configure_tracing
+from agent.warmup import warm_up
 
 app = Flask("goat_nlp")
 
@@ -37,6 +20,61 @@ app.logger.setLevel(logging.INFO)
 
 logger = logging.getLogger("goat_nlp.app")
 
+ready = threading.Event()
+startup_report = {}
+
+
+def configure_llm():
+    from llama_index.core import Settings
+    from llama_index.llms.ollama import Ollama
+
+    Settings.llm = Ollama(
+        model=os.getenv("OLLAMA_MODEL", "llama3"),
+        base_url=os.getenv("OLLAMA_HOST_URL", "http://127.0.0.1:11434"),
+        request_timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", 300)),
+    )
+
+
+def startup():
+    """Configure the LLM and tracing, build the pipeline and optionally warm up, then mark the app ready."""
+    start = time.perf_counter()
+    try:
+        configure_llm()
+        configure_tracing()
+        import agent.translator  # noqa: F401 - builds the pipeline and opens the caches
+        from agent.llm_gateway import get_llm_gateway
+
+        get_llm_gateway()  # checks the batching settings
+
+        if os.getenv("WARMUP", "false").lower() == "true":
+            startup_report["warmup"] = warm_up()
+    except Exception as e:
+        logger.exception("Startup failed")
+        startup_report["error"] = str(e)
+        return
+    startup_report["seconds"] = time.perf_counter() - start
+    logger.info(f"Ready after {startup_report['seconds']:.2f}s")
+    ready.set()
+
+
+# In background mode the server answers /healthz and /ready while startup runs.
+if os.getenv("STARTUP_MODE", "eager").lower() == "background":
+    threading.Thread(target=startup, name="goat_startup", daemon=True).start()
+else:
+    startup()
+
+
+def not_ready():
+    return {"url": "", "json_debug": "", "error": "Service is starting"}, 503
+
+
+def bad_request(message: str):
+    return {"error": message}, 400
+
+
+def overloaded(message: str, status: int):
+    return {"url": "", "json_debug": "", "error": message}, status, {"Retry-After": os.getenv("RETRY_AFTER", "5")}
+
 
 @app.route("/")
 def home():
@@ -45,16 +83,102 @@ def home():
 
 @app.route("/chat", methods=["POST"])
 def chat():
+    from agent.admission import get_llm_admission
+    from agent.deadline import (
+        REQUEST_DEADLINE,
+        Deadline,
+        DeadlineExceeded,
+        use_deadline,
+    )
+    from agent.translator import ServiceOverloaded, TranslationError, translate
+
+    if not ready.is_set():
+        return not_ready()
+    # Reject before doing any work when there is no room to queue.
+    if get_llm_admission().saturated():
+        return overloaded("LLM queue is full", 429)
     # agent.reset()
-    for _ in range(os.getenv("RETRY_LIMIT", 3)):
-        try:
-            # response = agent.chat(request.form["user_input"])
-            response = qp.run(input={"input": request.form["user_input"], "state": {}})
-            logger.info(response)
-            return {"url": str(response["state"]["final_url"]), "json_debug": ""}
-        except Exception:
-            continue
-    return {"url": "", "json_debug": ""}
+    try:
+        # response = agent.chat(request.form["user_input"])
+        with use_deadline(Deadline(REQUEST_DEADLINE)):
+            state = translate(request.form["user_input"], session_id=request.form.get("session_id"))
+    except ServiceOverloaded as e:
+        return overloaded(str(e), e.status)
+    except DeadlineExceeded as e:
+        return {"url": "", "json_debug": "", "error": str(e)}, 504
+    except TranslationError:
+        return {"url": "", "json_debug": ""}
+    return {"url": state["final_url"], "json_debug": "", "degraded": state.get("degraded", [])}
+
+
+@app.route("/chat/stream", methods=["GET", "POST"])
+def chat_stream():
+    """
+    Translate a query as server-sent events.
+
+    Emits a `stage` event with each stage's result as soon as it finishes, a
+    `url` event as soon as the URL is known, then `done` or `error`. The
+    translation is cancelled when the client disconnects. Messages sent with
+    the same `session_id` are treated as a conversation.
+    """
+    from agent.progress import translate_stream
+
+    if not ready.is_set():
+        return not_ready()
+    query = request.values.get("user_input", "")
+    session_id = request.values.get("session_id")
+    events = (
+        f"event: {event['event']}\ndata: {json.dumps(event)}\n\n" for event in translate_stream(query, session_id)
+    )
+    return Response(events, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """
+    Translate a list of queries, streaming one JSON line per query.
+
+    Accepts either a JSON body (`{"queries": [...], "max_workers": n}` or a bare
+    list) or plain text with one query per line.
+    """
+    from agent.batch import translate_batch
+
+    if not ready.is_set():
+        return not_ready()
+    if request.is_json:
+        body = request.get_json()
+        if not isinstance(body, (list, dict)):
+            return bad_request("Expected a list of queries or an object with a list of queries")
+        queries = body if isinstance(body, list) else body.get("queries", [])
+        max_workers = None if isinstance(body, list) else body.get("max_workers")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            return bad_request("queries must be a list of strings")
+        if max_workers is not None and (not isinstance(max_workers, int) or isinstance(max_workers, bool)):
+            return bad_request("max_workers must be an integer")
+    else:
+        queries = [line.strip() for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        max_workers = request.args.get("max_workers", type=int)
+
+    results = (json.dumps(result) + "\n" for result in translate_batch(queries, max_workers=max_workers))
+    return Response(results, mimetype="application/x-ndjson")
+
+
+@app.route("/metrics")
+def metrics():
+    """Per-stage, per-index and per-intent latency summaries in the Prometheus text format."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/healthz")
+def healthz():
+    """Liveness: the process is serving requests."""
+    return {"status": "ok"}
+
+
+@app.route("/ready")
+def ready_check():
+    """Readiness: the pipeline is built and warm-up has finished."""
+    return {"ready": ready.is_set(), **startup_report}, 200 if ready.is_set() else 503
 
 
 if __name__ == "__main__":
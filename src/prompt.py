@@ -316,3 +316,54 @@ The taxon_id HAS TO BE AN INTEGER.
 ```json
 """
 )
+
+CLASSIFICATION_PROMPT = PromptTemplate(
+    """
+You are an intelligent assistant who **ONLY ANSWERS IN JSON FORMAT**.
+
+A user is trying to query a genomics database.
+
+We need to identify three things about the query: its intent, its index and its timeframe.
+
+**Intent** can be one of the following three types:
+- **search**: The user is looking for information.
+- **count**: The user is looking for a count of something.
+- **record**: The user is looking for a specific record.
+
+Examples for each intent:
+- search: "What are the latest assemblies for the family Canidae?"
+- count: "How many bird species have been collected so far?"
+- record: "What information do we have about the African Elephant?"
+
+**Index** can be one of the following three types:
+- **taxon**: e.g. "How many bird species have been collected so far?", "What mushroom species have RNA seq?"
+- **assembly**: e.g. "What are the latest assemblies for the family Canidae?",
+    "How many genome assemblies are available for amphibians?"
+- **sample**: e.g. "Find samples with RNA-seq data for tigers", "Do any samples for cattle include RNA-seq data?"
+
+**Timeframe** is any time related information in the query, in YYYY-MM-DD format.
+The current date time is: {time}
+If there is no time related information in the query, return an empty string
+for both from_date and to_date.
+If 'from' is not applicable, return an empty string for from_date.
+If 'to' is not applicable, return an empty string for to_date.
+
+The query given by the user is as follows:
+`{query}`
+
+Return the result in the following JSON format:
+{{
+    "intent": "search or count or record",
+    "classification": "taxon or assembly or sample",
+    "from_date": "YYYY-MM-DD",
+    "to_date": "YYYY-MM-DD",
+    "explanation": "..."
+}}
+
+The intent and classification keys SHOULD HAVE ONLY ONE value each.
+You CANNOT reply with a combination of values,
+e.g. "classification": "taxon, assembly" or "intent": "search/count" IS NOT ALLOWED.
+
+```json
+"""
+)
@@ -0,0 +1,500 @@
+"""
+Offline benchmark of the translation stages and pipelines.
+
+Every stage in `agent.component_helpers` and every pipeline variant in
+`agent.query_pipeline` runs against a deterministic fake `Settings.llm` and a
+local stand-in for the GoaT API, using queries from
+`queries/script_generated_queries.json`. Wall time is split into simulated
+model time, GoaT API time and the remaining framework/JSON overhead. In the
+parallel pipelines model and API time are summed across worker threads, so
+they can add up to more than the wall time.
+
+Results are written to `benchmarks/<commit>.json`; pass an earlier result to
+`--compare` to report regressions (the exit status is 1 if any are found).
+
+Usage:
+    python -m scripts.benchmark_pipeline --queries 200
+    python -m scripts.benchmark_pipeline --compare benchmarks/abc1234.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from llama_index.core import PromptTemplate, Settings
+from llama_index.core.llms import (
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+import prompt
+
+logger = logging.getLogger("goat_nlp.benchmark")
+
+FAKE_TAXON_ID = "1000"
+PIPELINES = ("sequential", "sequential-fused", "parallel", "parallel-fused")
+
+# Literal text before each template's first placeholder; unique per prompt.
+_PROMPT_PREFIXES = {
+    name.removesuffix("_PROMPT").lower(): template.template.split("{")[0]
+    for name, template in vars(prompt).items()
+    if isinstance(template, PromptTemplate)
+}
+
+# The example currently being translated, so the fake LLM can answer consistently with it.
+_current_example: Dict[str, Any] = {}
+
+
+def fake_answer(stage: str, example: Dict[str, Any]) -> Dict[str, Any]:
+    """A valid response for `stage` that agrees with the example's generated labels."""
+    from agent.fast_classifier import labels_from_example
+
+    labels = example["json_output"]
+    from_date = labels.get("time_frame_query", "").partition(">=")[2]
+    taxon = labels.get("taxon")
+    answers = {
+        "intent": {"intent": labels["intent"]},
+        "index": {"classification": labels_from_example(example)["index"]},
+        "time": {"from_date": from_date, "to_date": ""},
+        "entity": {
+            "entities": (
+                [{"singular_form": taxon, "plural_form": f"{taxon}s", "scientific_name": taxon}] if taxon else []
+            )
+        },
+        "rank": {"rank": labels.get("rank", ""), "taxon_id": FAKE_TAXON_ID if labels.get("rank") else ""},
+        "attribute": {
+            "attributes": (
+                [{"attribute": labels["field"], "condition": "", "value": ""}] if labels.get("field") else []
+            )
+        },
+        "lineage": {"taxon_id": FAKE_TAXON_ID},
+        "record": {"taxon_id": FAKE_TAXON_ID},
+    }
+    answers["classification"] = {**answers["intent"], **answers["index"], **answers["time"]}
+    return {**answers[stage], "explanation": f"Benchmark answer for the {stage} stage."}
+
+
+class BenchmarkLLM(CustomLLM):
+    """Deterministic LLM that recognises the prompt template and answers from the current example."""
+
+    delay: float = 0.0
+    total_time: float = 0.0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="benchmark")
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        start = time.perf_counter()
+        stage = next(stage for stage, prefix in _PROMPT_PREFIXES.items() if prompt.startswith(prefix))
+        if self.delay:
+            time.sleep(self.delay)
+        text = "```json\n" + json.dumps(fake_answer(stage, _current_example)) + "\n```"
+        self.total_time += time.perf_counter() - start
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        """The whole `complete` answer as a single chunk."""
+        response = self.complete(prompt, formatted, **kwargs)
+
+        def gen() -> CompletionResponseGen:
+            yield CompletionResponse(text=response.text, delta=response.text)
+
+        return gen()
+
+
+def _lineage(depth: int) -> List[Dict[str, Any]]:
+    return [
+        {"taxon_id": str(1000 + i), "taxon_rank": "clade", "scientific_name": f"Clade {i}", "node_depth": i}
+        for i in range(1, depth + 1)
+    ]
+
+
+class GoatStubHandler(BaseHTTPRequestHandler):
+    """Serves `resultFields` and `search` responses shaped like the GoaT API's."""
+
+    fields = 60
+    results = 10
+    lineage_depth = 20
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.endswith("/resultFields"):
+            body = {
+                "status": {"success": True},
+                "fields": {
+                    f"field_{i}": {
+                        "description": f"Synthetic attribute number {i}",
+                        "constraint": {"enum": ["a", "b", "c"]} if i % 3 == 0 else {},
+                        "value_metadata": {"default": {"description": "synthetic"}} if i % 5 == 0 else None,
+                    }
+                    for i in range(self.fields)
+                },
+            }
+        elif url.path.endswith("/search"):
+            body = {
+                "status": {"success": True, "hits": self.results},
+                "results": [
+                    {
+                        "result": {
+                            "taxon_id": str(int(FAKE_TAXON_ID) + i),
+                            "taxon_rank": "species",
+                            "scientific_name": f"{params.get('query', [''])[0][:40]} {i}",
+                            "taxon_names": [{"name": f"common name {i}"}],
+                            "lineage": _lineage(self.lineage_depth),
+                        }
+                    }
+                    for i in range(min(self.results, int(params.get("size", [self.results])[0])))
+                ],
+            }
+        else:
+            self.send_error(404)
+            return
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_goat_stub() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GoatStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class GoatTimer:
+    """
+    Accumulates the wall time during which at least one `GoatClient.get_json` call is in flight.
+
+    Overlapping calls from several threads are counted once, so the GoaT time
+    never exceeds the wall time of the run being measured.
+    """
+
+    def __init__(self, client):
+        self.total_time = 0.0
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._busy_since = 0.0
+        get_json = client.get_json
+
+        def timed_get_json(endpoint, params):
+            with self._lock:
+                if not self._in_flight:
+                    self._busy_since = time.perf_counter()
+                self._in_flight += 1
+            try:
+                return get_json(endpoint, params)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    if not self._in_flight:
+                        self.total_time += time.perf_counter() - self._busy_since
+
+        client.get_json = timed_get_json
+
+
+def summarize(samples: List[Dict[str, float]], errors: int, allocations: Optional[List[Dict[str, float]]]) -> Dict:
+    wall = [sample["wall"] for sample in samples]
+    total = sum(wall)
+    summary = {
+        "runs": len(samples),
+        "errors": errors,
+        "total_s": total,
+        "throughput_per_s": len(samples) / total if total else 0.0,
+    }
+    if wall:
+        summary.update(
+            {
+                "mean_ms": 1000 * statistics.fmean(wall),
+                "p50_ms": 1000 * statistics.median(wall),
+                "p95_ms": 1000 * sorted(wall)[int(0.95 * (len(wall) - 1))],
+                "llm_ms": 1000 * statistics.fmean(sample["llm"] for sample in samples),
+                "goat_ms": 1000 * statistics.fmean(sample["goat"] for sample in samples),
+                "overhead_ms": 1000
+                * statistics.fmean(sample["wall"] - sample["llm"] - sample["goat"] for sample in samples),
+            }
+        )
+    if allocations:
+        summary["allocated_kb"] = statistics.fmean(allocation["allocated"] for allocation in allocations) / 1024
+        summary["peak_kb"] = statistics.fmean(allocation["peak"] for allocation in allocations) / 1024
+    return summary
+
+
+class Benchmark:
+    """
+    Runs the stages and pipelines over a list of examples.
+
+    Args:
+        examples (list): Examples from the generated query dataset.
+        llm (BenchmarkLLM): The fake LLM installed as `Settings.llm`.
+        goat_timer (GoatTimer): Timer wrapping the GoaT client.
+        warm (bool): Keep GoaT API responses cached between queries.
+    """
+
+    def __init__(self, examples: List[Dict[str, Any]], llm: BenchmarkLLM, goat_timer: GoatTimer, warm: bool):
+        self.examples = examples
+        self.llm = llm
+        self.goat_timer = goat_timer
+        self.warm = warm
+
+    def _measure(self, example: Dict[str, Any], fn: Callable[[], Any], trace: bool) -> Dict[str, float]:
+        global _current_example
+        _current_example = example
+        if not self.warm:
+            from agent.component_helpers import (
+                attribute_api_call,
+                entity_lookup,
+                search_api_call,
+            )
+
+            attribute_api_call.cache_clear()
+            entity_lookup.cache_clear()
+            search_api_call.cache_clear()
+
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            current, peak = tracemalloc.get_traced_memory()
+            return {"allocated": max(current - before, 0), "peak": max(peak - before, 0)}
+
+        llm_before, goat_before = self.llm.total_time, self.goat_timer.total_time
+        start = time.perf_counter()
+        fn()
+        return {
+            "wall": time.perf_counter() - start,
+            "llm": self.llm.total_time - llm_before,
+            "goat": self.goat_timer.total_time - goat_before,
+        }
+
+    def run_stages(self, trace: bool) -> Dict[str, Dict[str, Any]]:
+        """
+        Run every stage in sequential pipeline order on a fresh state per query.
+
+        Prefetching is turned off while the stages run: its background GoaT calls
+        would otherwise be counted against whichever stage is being timed.
+        """
+        from agent import component_helpers as helpers
+
+        prefetch, helpers.PREFETCH = helpers.PREFETCH, False
+        try:
+            return self._run_stages(helpers, trace)
+        finally:
+            helpers.PREFETCH = prefetch
+
+    def _run_stages(self, helpers, trace: bool) -> Dict[str, Dict[str, Any]]:
+
+        stages = {
+            "intent": helpers.identify_intent,
+            "index": helpers.identify_index,
+            "time": helpers.identify_time_frame,
+            "classification": helpers.identify_classification,
+            "entity": helpers.identify_entity,
+            "record": helpers.identify_record,
+            "rank": helpers.identify_rank,
+            "attribute": helpers.identify_attributes,
+            "query": helpers.construct_query,
+            "url": helpers.construct_url,
+        }
+        results = {stage: {"samples": [], "errors": 0} for stage in stages}
+        for example in self.examples:
+            query, state = example["english_query"], {}
+            order = ["intent", "index", "time", "classification", "entity"]
+            is_record = example["json_output"]["intent"] == "record"
+            order += ["record"] if is_record else ["rank", "attribute", "query", "url"]
+            for stage in order:
+                try:
+                    sample = self._measure(example, lambda: stages[stage](query, state), trace)
+                except Exception:
+                    logger.exception(f"Stage {stage} failed for {query!r}")
+                    results[stage]["errors"] += 1
+                    break
+                results[stage]["samples"].append(sample)
+        return results
+
+    def run_pipelines(self, names: List[str], trace: bool) -> Dict[str, Dict[str, Any]]:
+        from agent.query_pipeline import PIPELINE_BUILDERS
+
+        results = {}
+        for name in names:
+            mode, _, fused = name.partition("-")
+            pipeline = PIPELINE_BUILDERS[mode](fused=fused == "fused")
+            pipeline.verbose = False
+            results[name] = {"samples": [], "errors": 0}
+            for example in self.examples:
+                outcome = {}
+
+                def run():
+                    outcome.update(pipeline.run(input={"input": example["english_query"], "state": {}}))
+
+                results[name]["samples"].append(self._measure(example, run, trace))
+                if outcome.get("error") or "final_url" not in outcome.get("state", {}):
+                    results[name]["errors"] += 1
+        return results
+
+
+def sample_examples(examples: List[Dict[str, Any]], count: int, seed: int) -> List[Dict[str, Any]]:
+    """Sample `count` examples in proportion to their intent, with at least one of each intent."""
+    by_intent: Dict[str, List[Dict[str, Any]]] = {}
+    for example in examples:
+        by_intent.setdefault(example["json_output"]["intent"], []).append(example)
+    rng = random.Random(seed)
+    sample = []
+    for intent in sorted(by_intent):
+        group = by_intent[intent]
+        sample += rng.sample(group, min(len(group), max(1, round(count * len(group) / len(examples)))))
+    rng.shuffle(sample)
+    return sample
+
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True))
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": True}
+    return {"commit": commit, "dirty": dirty}
+
+
+def compare(previous: Dict, current: Dict, threshold: float, min_delta_ms: float) -> List[str]:
+    """
+    Print median time changes per stage and pipeline and return the names that regressed.
+
+    A regression is a slowdown of more than `threshold` percent and `min_delta_ms`
+    milliseconds, so sub-millisecond stages do not flag on timer noise.
+    """
+    regressions = []
+    print(f"{'':<28}{'p50 before':>12}{'p50 after':>12}{'change':>10}")
+    for section in ("stages", "pipelines"):
+        for name, after in current[section].items():
+            before = previous.get(section, {}).get(name)
+            if not before or "p50_ms" not in before or "p50_ms" not in after:
+                continue
+            delta = after["p50_ms"] - before["p50_ms"]
+            change = 100 * delta / before["p50_ms"] if before["p50_ms"] else 0.0
+            flag = ""
+            if change > threshold and delta > min_delta_ms:
+                regressions.append(f"{section}/{name}")
+                flag = "  REGRESSION"
+            print(f"{section + '/' + name:<28}{before['p50_ms']:>12.3f}{after['p50_ms']:>12.3f}{change:>9.1f}%{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the translation stages and pipelines offline.")
+    parser.add_argument("--data", default="queries/script_generated_queries.json", help="Query dataset")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries to sample")
+    parser.add_argument("--seed", type=int, default=0, help="Sampling seed")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="Simulated seconds per completion")
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help="Comma-separated pipeline variants")
+    parser.add_argument("--warm", action="store_true", help="Keep GoaT API responses cached between queries")
+    parser.add_argument("--no-alloc", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--out", help="Result file (default: benchmarks/<commit>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Slowdown in percent counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.1, help="Smallest slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    server = start_goat_stub()
+    os.environ["GOAT_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/api/v2"
+    from agent.goat_client import get_goat_client
+
+    get_goat_client.cache_clear()
+    goat_timer = GoatTimer(get_goat_client())
+    llm = BenchmarkLLM(delay=args.llm_delay)
+    Settings.llm = llm
+
+    with open(args.data) as data_file:
+        examples = json.load(data_file)
+    examples = sample_examples(examples, args.queries, args.seed)
+    pipelines = [name for name in args.pipelines.split(",") if name]
+    benchmark = Benchmark(examples, llm, goat_timer, args.warm)
+
+    stages = benchmark.run_stages(trace=False)
+    pipeline_results = benchmark.run_pipelines(pipelines, trace=False)
+    stage_allocations, pipeline_allocations = {}, {}
+    if not args.no_alloc:
+        tracemalloc.start()
+        stage_allocations = benchmark.run_stages(trace=True)
+        pipeline_allocations = benchmark.run_pipelines(pipelines, trace=True)
+        tracemalloc.stop()
+    server.shutdown()
+
+    revision = git_revision()
+    results = {
+        "meta": {
+            **revision,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "queries": len(examples),
+            "seed": args.seed,
+            "llm_delay": args.llm_delay,
+            "warm": args.warm,
+            "env": {
+                key: os.getenv(key)
+                for key in ("FAST_CLASSIFIER_PATH", "TAXONOMY_PATH", "ATTRIBUTE_TOP_K", "COMPACT_PROMPTS")
+                if os.getenv(key)
+            },
+        },
+        "stages": {
+            name: summarize(result["samples"], result["errors"], stage_allocations.get(name, {}).get("samples"))
+            for name, result in stages.items()
+        },
+        "pipelines": {
+            name: summarize(result["samples"], result["errors"], pipeline_allocations.get(name, {}).get("samples"))
+            for name, result in pipeline_results.items()
+        },
+    }
+
+    out = args.out or os.path.join("benchmarks", f"{revision['commit']}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as out_file:
+        json.dump(results, out_file, indent=2)
+
+    print(f"{'':<28}{'mean ms':>10}{'p95 ms':>10}{'llm ms':>10}{'goat ms':>10}{'other ms':>10}{'per s':>10}")
+    for section in ("stages", "pipelines"):
+        for name, summary in results[section].items():
+            if summary["runs"]:
+                print(
+                    f"{section + '/' + name:<28}{summary['mean_ms']:>10.3f}{summary['p95_ms']:>10.3f}"
+                    f"{summary['llm_ms']:>10.3f}{summary['goat_ms']:>10.3f}{summary['overhead_ms']:>10.3f}"
+                    f"{summary['throughput_per_s']:>10.1f}"
+                )
+    print(f"Saved results to {out}")
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            regressions = compare(json.load(previous_file), results, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"Regressions over {args.threshold}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())